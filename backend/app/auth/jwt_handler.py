@@ -1,13 +1,24 @@
 from jose import jwt, JWTError
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
+from cachetools import TTLCache
+import hashlib
 import os
+import time
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
+ADMIN_TOKEN_EXPIRE_MINUTES = 15  # Short-lived so role revocation propagates quickly
+
+# Verified token payloads, keyed by a token digest (never the raw token)
+_token_cache: TTLCache = TTLCache(maxsize=10000, ttl=30)
+
+
+def _token_key(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()[:16]
 
 def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta] = None) -> str:
     """Create JWT access token"""
@@ -24,12 +35,20 @@ def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta]
 
 def verify_token(token: str) -> Optional[Dict[str, Any]]:
     """Verify JWT token and return payload"""
+    key = _token_key(token)
+    payload = _token_cache.get(key)
+    if payload is not None and payload.get("exp", 0) > time.time():
+        # Copy: callers must not mutate the shared cached claims
+        return dict(payload)
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except JWTError:
         return None
 
+    _token_cache[key] = payload
+    return dict(payload)
+
 def get_token_data(token: str) -> Optional[Dict[str, Any]]:
     """Extract user data from token"""
     payload = verify_token(token)
@@ -47,15 +66,14 @@ def get_token_data(token: str) -> Optional[Dict[str, Any]]:
 security = HTTPBearer()
 
 
-async def get_current_user(
+async def current_payload(
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ) -> Dict[str, Any]:
     """
-    FastAPI dependency to get current authenticated user from JWT token.
-    Use this in route dependencies: Depends(get_current_user)
+    FastAPI dependency returning the verified JWT payload.
+    Use this in route dependencies: payload: dict = Depends(current_payload)
     """
-    token = credentials.credentials
-    payload = verify_token(token)
+    payload = verify_token(credentials.credentials)
 
     if payload is None:
         raise HTTPException(
@@ -64,8 +82,18 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    return payload
+
+
+async def get_current_user(
+    payload: Dict[str, Any] = Depends(current_payload)
+) -> Dict[str, Any]:
+    """
+    FastAPI dependency to get current authenticated user from JWT token.
+    Use this in route dependencies: Depends(get_current_user)
+    """
     return {
         "user_id": payload.get("uid"),
         "email": payload.get("email"),
         "display_name": payload.get("display_name"),
-    }
\ No newline at end of file
+    }
@@ -1,11 +1,27 @@
 import bcrypt
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+
+# argon2id with OWASP interactive-login parameters (19 MiB, t=2, p=1)
+_hasher = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1, hash_len=32)
+
+
+def _is_bcrypt_hash(hashed: str) -> bool:
+    return hashed.startswith(("$2a$", "$2b$", "$2y$"))
 
 def hash_password(password: str) -> str:
-    """Hash password using bcrypt"""
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed.decode('utf-8')
+    """Hash password using argon2id"""
+    return _hasher.hash(password)
 
 def verify_password(password: str, hashed: str) -> bool:
-    """Verify password against hash"""
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
\ No newline at end of file
+    """Verify password against hash (argon2id, or legacy bcrypt)"""
+    if _is_bcrypt_hash(hashed):
+        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    try:
+        return _hasher.verify(hashed, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+def needs_rehash(hashed: str) -> bool:
+    """Whether a stored hash should be upgraded after a successful login"""
+    return _is_bcrypt_hash(hashed) or _hasher.check_needs_rehash(hashed)
@@ -1,5 +1,6 @@
 import os
-from typing import AsyncGenerator
+import orjson
+from typing import AsyncGenerator, Generator
 from sqlalchemy import create_engine
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker, Session
@@ -17,9 +18,37 @@ elif DATABASE_URL.startswith("postgresql://") and "+asyncpg" not in DATABASE_URL
     # Add asyncpg driver for async operations
     DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
 
+# PostgreSQL pool sizing and asyncpg prepared statement caches
+# (repeated admin/API queries skip re-planning). A request holds one pooled
+# connection for the life of its session, so bursts of /sync/mab calls need
+# overflow headroom; keep pool_size + max_overflow (per worker) under the
+# server's max_connections.
+async_engine_options = {}
+if "+asyncpg" in DATABASE_URL:
+    async_engine_options = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "20")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "40")),
+        "pool_recycle": 1800,
+        "connect_args": {"statement_cache_size": 1024, "prepared_statement_cache_size": 1024},
+    }
+
+# orjson codec for JSON columns (options, match_pairs, tags) on both engines
+def _json_serializer(value) -> str:
+    return orjson.dumps(value).decode()
+
 # Async engine for FastAPI
-async_engine = create_async_engine(DATABASE_URL, echo=False, pool_pre_ping=True)
-AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, class_=AsyncSession)
+async_engine = create_async_engine(
+    DATABASE_URL,
+    echo=False,
+    pool_pre_ping=True,
+    query_cache_size=1200,
+    json_serializer=_json_serializer,
+    json_deserializer=orjson.loads,
+    **async_engine_options,
+)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, expire_on_commit=False, autoflush=False, class_=AsyncSession
+)
 
 # Sync engine for Celery and batch jobs
 sync_database_url = DATABASE_URL.replace("+asyncpg", "").replace("+aiomysql", "")
@@ -28,7 +57,20 @@ if "postgresql://" in sync_database_url:
 elif "mysql://" in sync_database_url:
     sync_database_url = sync_database_url.replace("mysql://", "mysql+pymysql://")
 
-sync_engine = create_engine(sync_database_url, echo=False, pool_pre_ping=True)
+# Pooled per Celery worker process: scheduled tasks check out an existing
+# connection instead of re-authenticating on every run
+sync_engine_options = {}
+if "postgresql" in sync_database_url:
+    sync_engine_options = {"pool_size": 5, "max_overflow": 5, "pool_recycle": 1800}
+
+sync_engine = create_engine(
+    sync_database_url,
+    echo=False,
+    pool_pre_ping=True,
+    json_serializer=_json_serializer,
+    json_deserializer=orjson.loads,
+    **sync_engine_options,
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=sync_engine)
 
 # Async session generator for FastAPI
@@ -36,8 +78,8 @@ async def get_session() -> AsyncGenerator[AsyncSession, None]:
     async with AsyncSessionLocal() as session:
         yield session
 
-# Sync session generator for Celery
-def get_db() -> AsyncGenerator[Session, None]:
+# Sync session generator for Celery - reuses the module-level SessionLocal factory
+def get_sync_db() -> Generator[Session, None, None]:
     db = SessionLocal()
     try:
         yield db
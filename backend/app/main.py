@@ -1,29 +1,28 @@
+import asyncio
 import os
+import httpx
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.ext.asyncio import AsyncEngine
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy import text
 
 # Import directly from routers/main.py
-print("🔧 Attempting to import main router...")
-try:
-    from .routers.main import router
-    print("✅ Main router imported successfully")
-    print(f"🔍 Main router routes: {[route.path for route in router.routes]}")
-except Exception as e:
-    print(f"❌ Main router import failed: {e}")
-    import traceback
-    print(f"❌ Full traceback: {traceback.format_exc()}")
-    raise
+from .routers.main import router
+from .routers.difficulty import router as difficulty_router
 from .models import Base
 from .models.user import UserDB
 from .db import async_engine
+from .services import response_buffer, gemini_service, semantic_cache
+from .services.difficulty_calculator import DIFFICULTY_VIEW, DIFFICULTY_VIEW_STATEMENTS
 
 app = FastAPI(
     title="MAB Quiz API", 
     version="1.0.0",
-    description="Multi-Armed Bandit Quiz System with Dynamic Difficulty"
+    description="Multi-Armed Bandit Quiz System with Dynamic Difficulty",
+    default_response_class=ORJSONResponse,
 )
 
 # CORS - Production ve development ortamları için
@@ -63,6 +62,8 @@ async def global_exception_handler(request: StarletteRequest, exc: Exception):
 
 # Register routes
 app.include_router(router)
+# /api/difficulty: metrics and buffered student response submission
+app.include_router(difficulty_router)
 
 # Manual auth endpoints as fallback
 from fastapi import HTTPException, Depends
@@ -70,6 +71,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from .db import get_session
 import uuid
 import json
+from datetime import timedelta
 
 # Simple manual endpoint without complex types
 import json as json_lib
@@ -82,7 +84,7 @@ async def manual_register(request: Request, db: AsyncSession = Depends(get_sessi
     try:
         from .models.user import UserDB
         from .auth.password_utils import hash_password
-        from sqlalchemy import select
+        from sqlalchemy.exc import IntegrityError
         
         # Parse JSON from request
         body = await request.json()
@@ -93,16 +95,8 @@ async def manual_register(request: Request, db: AsyncSession = Depends(get_sessi
         last_name = body.get("last_name")
         department = body.get("department", "general")
         
-        # Check if user exists (email or username)
-        email_check = await db.execute(select(UserDB).filter(UserDB.email == email))
-        username_check = await db.execute(select(UserDB).filter(UserDB.username == username))
-        if email_check.scalar_one_or_none():
-            raise HTTPException(status_code=400, detail="Email already registered")
-        if username_check.scalar_one_or_none():
-            raise HTTPException(status_code=400, detail="Username already taken")
-        
-        # Create user
-        hashed_password = hash_password(password)
+        # Create user - duplicates are rejected by the unique indexes on email/username
+        hashed_password = await asyncio.to_thread(hash_password, password)
         user_uid = str(uuid.uuid4())
         
         db_user = UserDB(
@@ -118,7 +112,11 @@ async def manual_register(request: Request, db: AsyncSession = Depends(get_sessi
         )
         
         db.add(db_user)
-        await db.commit()
+        try:
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            raise HTTPException(status_code=400, detail="Email or username already registered")
         await db.refresh(db_user)
         
         return {
@@ -127,6 +125,8 @@ async def manual_register(request: Request, db: AsyncSession = Depends(get_sessi
             "display_name": db_user.display_name,
             "email_verified": db_user.email_verified
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -134,8 +134,9 @@ async def manual_register(request: Request, db: AsyncSession = Depends(get_sessi
 async def manual_login(request: Request, db: AsyncSession = Depends(get_session)):
     """Manual login endpoint"""
     try:
-        from .models.user import UserDB
-        from .auth.password_utils import verify_password
+        from .models.user import UserDB, USER_LOGIN_COLUMNS
+        from sqlalchemy.orm import load_only
+        from .auth.password_utils import hash_password, verify_password, needs_rehash
         from .auth.jwt_handler import create_access_token
         from sqlalchemy import select
         
@@ -145,20 +146,26 @@ async def manual_login(request: Request, db: AsyncSession = Depends(get_session)
         password = body.get("password")
         
         # Find user by username
-        result = await db.execute(select(UserDB).filter(UserDB.username == username))
+        result = await db.execute(select(UserDB).options(load_only(*USER_LOGIN_COLUMNS)).filter(UserDB.username == username))
         user = result.scalar_one_or_none()
         if not user:
             raise HTTPException(status_code=401, detail="Invalid credentials")
         
         # Verify password
-        if not verify_password(password, user.password_hash):
+        if not await asyncio.to_thread(verify_password, password, user.password_hash):
             raise HTTPException(status_code=401, detail="Invalid credentials")
+
+        # Transparently migrate legacy bcrypt hashes to argon2id
+        if needs_rehash(user.password_hash):
+            user.password_hash = await asyncio.to_thread(hash_password, password)
+            await db.commit()
         
         # Create token
         token_data = {
             "uid": user.uid,
             "email": user.email,
-            "display_name": user.display_name
+            "display_name": user.display_name,
+            "email_verified": user.email_verified
         }
         access_token = create_access_token(token_data)
         
@@ -181,10 +188,11 @@ async def manual_login(request: Request, db: AsyncSession = Depends(get_session)
 async def admin_login(request: Request, db: AsyncSession = Depends(get_session)):
     """Admin login endpoint - requires admin role"""
     try:
-        from .models.user import UserDB
+        from .models.user import UserDB, USER_LOGIN_COLUMNS
+        from sqlalchemy.orm import load_only
         from .models.user_role import UserRole
-        from .auth.password_utils import verify_password
-        from .auth.jwt_handler import create_access_token
+        from .auth.password_utils import hash_password, verify_password, needs_rehash
+        from .auth.jwt_handler import create_access_token, ADMIN_TOKEN_EXPIRE_MINUTES
         from sqlalchemy import select
 
         body = await request.json()
@@ -192,15 +200,20 @@ async def admin_login(request: Request, db: AsyncSession = Depends(get_session))
         password = body.get("password")
 
         # Find user by username
-        result = await db.execute(select(UserDB).filter(UserDB.username == username))
+        result = await db.execute(select(UserDB).options(load_only(*USER_LOGIN_COLUMNS)).filter(UserDB.username == username))
         user = result.scalar_one_or_none()
         if not user:
             raise HTTPException(status_code=401, detail="Invalid credentials")
 
         # Verify password
-        if not verify_password(password, user.password_hash):
+        if not await asyncio.to_thread(verify_password, password, user.password_hash):
             raise HTTPException(status_code=401, detail="Invalid credentials")
 
+        # Transparently migrate legacy bcrypt hashes to argon2id
+        if needs_rehash(user.password_hash):
+            user.password_hash = await asyncio.to_thread(hash_password, password)
+            await db.commit()
+
         # Check if user has admin role
         role_result = await db.execute(
             select(UserRole).filter(UserRole.user_uid == user.uid, UserRole.role == "admin")
@@ -209,14 +222,18 @@ async def admin_login(request: Request, db: AsyncSession = Depends(get_session))
         if not admin_role:
             raise HTTPException(status_code=403, detail="Access denied. Admin privileges required.")
 
-        # Create token with admin flag
+        # Create short-lived token with admin role claim
         token_data = {
             "uid": user.uid,
             "email": user.email,
             "display_name": user.display_name,
-            "is_admin": True
+            "email_verified": user.email_verified,
+            "is_admin": True,
+            "role": "admin"
         }
-        access_token = create_access_token(token_data)
+        access_token = create_access_token(
+            token_data, expires_delta=timedelta(minutes=ADMIN_TOKEN_EXPIRE_MINUTES)
+        )
 
         return {
             "access_token": access_token,
@@ -234,15 +251,18 @@ async def admin_login(request: Request, db: AsyncSession = Depends(get_session))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Pooled client for Google's tokeninfo endpoint (reuses the TLS connection)
+_google_http = httpx.AsyncClient(timeout=10.0)
+
 @app.post("/api/v1/auth/admin/google")
 async def admin_google_login(request: Request, db: AsyncSession = Depends(get_session)):
     """Admin Google login endpoint - requires admin role"""
     try:
-        from .models.user import UserDB
+        from .models.user import UserDB, USER_PROFILE_COLUMNS
+        from sqlalchemy.orm import load_only
         from .models.user_role import UserRole
-        from .auth.jwt_handler import create_access_token
+        from .auth.jwt_handler import create_access_token, ADMIN_TOKEN_EXPIRE_MINUTES
         from sqlalchemy import select
-        import requests
 
         body = await request.json()
         id_token = body.get("id_token")
@@ -251,8 +271,8 @@ async def admin_google_login(request: Request, db: AsyncSession = Depends(get_se
             raise HTTPException(status_code=400, detail="ID token required")
 
         # Verify Google token
-        google_response = requests.get(
-            f"https://oauth2.googleapis.com/tokeninfo?id_token={id_token}"
+        google_response = await _google_http.get(
+            "https://oauth2.googleapis.com/tokeninfo", params={"id_token": id_token}
         )
 
         if google_response.status_code != 200:
@@ -263,12 +283,12 @@ async def admin_google_login(request: Request, db: AsyncSession = Depends(get_se
         email = google_data.get("email")
 
         # Find user by google_id
-        result = await db.execute(select(UserDB).filter(UserDB.google_id == google_id))
+        result = await db.execute(select(UserDB).options(load_only(*USER_PROFILE_COLUMNS)).filter(UserDB.google_id == google_id))
         user = result.scalar_one_or_none()
 
         if not user:
             # Try to find by email
-            result = await db.execute(select(UserDB).filter(UserDB.email == email))
+            result = await db.execute(select(UserDB).options(load_only(*USER_PROFILE_COLUMNS)).filter(UserDB.email == email))
             user = result.scalar_one_or_none()
 
         if not user:
@@ -282,14 +302,18 @@ async def admin_google_login(request: Request, db: AsyncSession = Depends(get_se
         if not admin_role:
             raise HTTPException(status_code=403, detail="Access denied. Admin privileges required.")
 
-        # Create token with admin flag
+        # Create short-lived token with admin role claim
         token_data = {
             "uid": user.uid,
             "email": user.email,
             "display_name": user.display_name,
-            "is_admin": True
+            "email_verified": user.email_verified,
+            "is_admin": True,
+            "role": "admin"
         }
-        access_token = create_access_token(token_data)
+        access_token = create_access_token(
+            token_data, expires_delta=timedelta(minutes=ADMIN_TOKEN_EXPIRE_MINUTES)
+        )
 
         return {
             "access_token": access_token,
@@ -311,7 +335,8 @@ async def admin_google_login(request: Request, db: AsyncSession = Depends(get_se
 async def get_current_user(request: Request, db: AsyncSession = Depends(get_session)):
     """Get current user info"""
     try:
-        from .models.user import UserDB
+        from .models.user import UserDB, USER_PROFILE_COLUMNS
+        from sqlalchemy.orm import load_only
         from .auth.jwt_handler import verify_token
         from sqlalchemy import select
         
@@ -325,8 +350,16 @@ async def get_current_user(request: Request, db: AsyncSession = Depends(get_sess
         if not payload:
             raise HTTPException(status_code=401, detail="Invalid token")
         
-        # Get user from database
-        result = await db.execute(select(UserDB).filter(UserDB.uid == payload.get("uid")))
+        if "email_verified" in payload:
+            return {
+                "uid": payload["uid"],
+                "email": payload["email"],
+                "display_name": payload.get("display_name"),
+                "email_verified": payload["email_verified"]
+            }
+        
+        # Tokens issued before email_verified was a claim - get user from database
+        result = await db.execute(select(UserDB).options(load_only(*USER_PROFILE_COLUMNS)).filter(UserDB.uid == payload.get("uid")))
         user = result.scalar_one_or_none()
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
@@ -406,6 +439,13 @@ async def run_migrations():
 async def on_startup():
     """Application startup tasks"""
     print("🚀 Starting application...")
+
+    # Password hashing (argon2id, plus legacy bcrypt verification) runs in the
+    # default executor; size it for concurrent logins
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4))
+    )
+
     try:
         # Verify connection
         async with async_engine.begin() as conn:
@@ -419,12 +459,30 @@ async def on_startup():
         async with async_engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
             print("✅ Tables created/verified")
+
+        # 30-day aggregate read by DifficultyCalculator (needs student_responses)
+        if async_engine.dialect.name == "postgresql":
+            async with async_engine.begin() as conn:
+                for statement in DIFFICULTY_VIEW_STATEMENTS:
+                    await conn.execute(text(statement))
+                print(f"✅ {DIFFICULTY_VIEW} created/verified")
+
+        # Batched student response writer
+        response_buffer.start()
     except Exception as e:
         print(f"❌ Startup failed: {e}")
         import traceback
         print(traceback.format_exc())
         raise
 
+@app.on_event("shutdown")
+async def on_shutdown():
+    """Flush buffered writes before the process exits"""
+    await response_buffer.stop()
+    await _google_http.aclose()
+    await gemini_service.close_client()
+    await semantic_cache.flush()
+
 @app.get("/health")
 async def health():
     # Check database connection
@@ -18,6 +18,7 @@ from .user import UserDB
 from .quiz_session import UserQuizSession
 from .mab_state import UserMABQuestionArm, UserMABTopicArm
 from .user_role import UserRole
+from .gemini_analysis import GeminiAnalysisRecord
 
 __all__ = [
     "Base",
@@ -34,4 +35,5 @@ __all__ = [
     "UserMABQuestionArm",
     "UserMABTopicArm",
     "UserRole",
+    "GeminiAnalysisRecord",
 ]
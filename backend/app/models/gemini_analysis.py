@@ -0,0 +1,30 @@
+"""
+Stored AI categorization suggestions produced by the background Gemini queue
+"""
+
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, JSON, ForeignKey, UniqueConstraint
+from sqlalchemy.sql import func
+from . import Base
+
+
+class GeminiAnalysisRecord(Base):
+    """Gemini analysis of a question by one analyze_questions_task run"""
+    __tablename__ = "gemini_analysis"
+
+    id = Column(Integer, primary_key=True, index=True)
+    question_id = Column(Integer, ForeignKey("questions.id", ondelete="CASCADE"), nullable=False, index=True)
+    task_id = Column(String(64), nullable=False)
+
+    # analyze_question result shape (success, topic, subtopic, knowledgeType, ...)
+    success = Column(Boolean, nullable=False)
+    result = Column(JSON, nullable=False)
+
+    # Timestamps
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    # One row per task and question: queueing a question again never hides an
+    # earlier task's results (a retried task overwrites its own rows)
+    __table_args__ = (
+        UniqueConstraint("task_id", "question_id", name="uq_gemini_analysis_task_question"),
+    )
@@ -35,23 +35,13 @@ class UserMABQuestionArm(Base):
     # Composite unique constraint
     __table_args__ = (
         Index('idx_user_question', 'user_id', 'question_id', unique=True),
+        # Delta sync: rows for a user changed since lastSyncTime
+        Index('idx_user_question_updated', 'user_id', 'updated_at'),
     )
 
     def to_dict(self):
         """Convert to dictionary"""
-        return {
-            "user_id": self.user_id,
-            "question_id": self.question_id,
-            "attempts": self.attempts,
-            "successes": self.successes,
-            "failures": self.failures,
-            "total_response_time_ms": self.total_response_time_ms,
-            "alpha": self.alpha,
-            "beta": self.beta,
-            "user_confidence": self.user_confidence,
-            "last_attempted": self.last_attempted.isoformat() if self.last_attempted else None,
-            "success_rate": round(self.successes / self.attempts, 3) if self.attempts > 0 else 0.0,
-        }
+        return question_arm_to_dict(self)
 
 
 class UserMABTopicArm(Base):
@@ -84,21 +74,74 @@ class UserMABTopicArm(Base):
     # Composite unique constraint
     __table_args__ = (
         Index('idx_user_topic', 'user_id', 'topic_key', unique=True),
+        # Delta sync: rows for a user changed since lastSyncTime
+        Index('idx_user_topic_updated', 'user_id', 'updated_at'),
     )
 
     def to_dict(self):
         """Convert to dictionary"""
-        return {
-            "user_id": self.user_id,
-            "topic_key": self.topic_key,
-            "course": self.course,
-            "topic": self.topic,
-            "knowledge_type": self.knowledge_type,
-            "attempts": self.attempts,
-            "successes": self.successes,
-            "failures": self.failures,
-            "total_response_time_ms": self.total_response_time_ms,
-            "alpha": self.alpha,
-            "beta": self.beta,
-            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
-        }
\ No newline at end of file
+        return topic_arm_to_dict(self)
+
+
+# Columns needed by the *_to_dict helpers, for Core selects that skip ORM hydration
+QUESTION_ARM_DICT_COLUMNS = (
+    UserMABQuestionArm.user_id,
+    UserMABQuestionArm.question_id,
+    UserMABQuestionArm.attempts,
+    UserMABQuestionArm.successes,
+    UserMABQuestionArm.failures,
+    UserMABQuestionArm.total_response_time_ms,
+    UserMABQuestionArm.alpha,
+    UserMABQuestionArm.beta,
+    UserMABQuestionArm.user_confidence,
+    UserMABQuestionArm.last_attempted,
+)
+TOPIC_ARM_DICT_COLUMNS = (
+    UserMABTopicArm.user_id,
+    UserMABTopicArm.topic_key,
+    UserMABTopicArm.course,
+    UserMABTopicArm.topic,
+    UserMABTopicArm.knowledge_type,
+    UserMABTopicArm.attempts,
+    UserMABTopicArm.successes,
+    UserMABTopicArm.failures,
+    UserMABTopicArm.total_response_time_ms,
+    UserMABTopicArm.alpha,
+    UserMABTopicArm.beta,
+    UserMABTopicArm.updated_at,
+)
+
+
+def question_arm_to_dict(arm):
+    """Serialize a UserMABQuestionArm or a Row selected with QUESTION_ARM_DICT_COLUMNS"""
+    return {
+        "user_id": arm.user_id,
+        "question_id": arm.question_id,
+        "attempts": arm.attempts,
+        "successes": arm.successes,
+        "failures": arm.failures,
+        "total_response_time_ms": arm.total_response_time_ms,
+        "alpha": arm.alpha,
+        "beta": arm.beta,
+        "user_confidence": arm.user_confidence,
+        "last_attempted": arm.last_attempted.isoformat() if arm.last_attempted else None,
+        "success_rate": round(arm.successes / arm.attempts, 3) if arm.attempts > 0 else 0.0,
+    }
+
+
+def topic_arm_to_dict(arm):
+    """Serialize a UserMABTopicArm or a Row selected with TOPIC_ARM_DICT_COLUMNS"""
+    return {
+        "user_id": arm.user_id,
+        "topic_key": arm.topic_key,
+        "course": arm.course,
+        "topic": arm.topic,
+        "knowledge_type": arm.knowledge_type,
+        "attempts": arm.attempts,
+        "successes": arm.successes,
+        "failures": arm.failures,
+        "total_response_time_ms": arm.total_response_time_ms,
+        "alpha": arm.alpha,
+        "beta": arm.beta,
+        "updated_at": arm.updated_at.isoformat() if arm.updated_at else None,
+    }
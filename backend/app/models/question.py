@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, JSON, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, JSON, ForeignKey, Index, text as sa_text
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from . import Base
@@ -43,6 +43,16 @@ class Question(Base):
     subtopic_rel = relationship("Subtopic", back_populates="questions")
     knowledge_type_rel = relationship("KnowledgeType", back_populates="questions")
 
+    # Indexes matching the admin question list filters (ORDER BY created_at DESC)
+    __table_args__ = (
+        Index(
+            "ix_questions_active_created",
+            "is_active", sa_text("created_at DESC"),
+            postgresql_where=sa_text("is_active"),
+        ),
+        Index("ix_questions_subtopic_active_created", "subtopic_id", "is_active", sa_text("created_at DESC")),
+    )
+
     def to_dict(self, include_relations=True):
         """Convert to dictionary for API responses"""
         result = {
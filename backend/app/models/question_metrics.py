@@ -2,7 +2,7 @@
 Database models for question difficulty metrics
 """
 
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, Index
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, Index, text
 from sqlalchemy.sql import func
 from datetime import datetime
 from . import Base
@@ -36,26 +36,53 @@ class QuestionMetrics(Base):
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
     
+    # Active rows by age, for the chunked deactivation in cleanup_old_metrics
+    __table_args__ = (
+        Index("idx_qm_active_lastcomp", "last_computed", postgresql_where=text("is_active")),
+        # Weekly report: recent active rows, hardest first
+        Index("idx_qm_active_lastcomp_difficulty", "is_active", "last_computed", text("difficulty_score DESC")),
+    )
+    
     def to_dict(self):
         """Convert to dictionary for API responses"""
-        return {
-            "question_id": self.question_id,
-            "dynamicMetrics": {
-                "globalSuccessRate": round(self.global_success_rate, 3),
-                "totalAttempts": self.total_attempts,
-                "averageResponseTime": round(self.average_response_time, 1),
-                "reachRate": round(self.reach_rate, 3),
-                "difficultyScore": round(self.difficulty_score, 3),
-                "computedAt": self.last_computed.isoformat(),
-                "sampleSize": self.total_attempts,
-                "confidenceInterval": {
-                    "lower": round(self.confidence_lower, 3),
-                    "upper": round(self.confidence_upper, 3)
-                }
-            },
-            "computedDifficulty": self.computed_difficulty,
-            "lastUpdated": self.updated_at.isoformat() if self.updated_at else None
-        }
+        return metrics_to_dict(self)
+
+
+# Columns needed by metrics_to_dict, for Core selects that skip ORM hydration
+METRICS_DICT_COLUMNS = (
+    QuestionMetrics.question_id,
+    QuestionMetrics.global_success_rate,
+    QuestionMetrics.total_attempts,
+    QuestionMetrics.average_response_time,
+    QuestionMetrics.reach_rate,
+    QuestionMetrics.difficulty_score,
+    QuestionMetrics.computed_difficulty,
+    QuestionMetrics.confidence_lower,
+    QuestionMetrics.confidence_upper,
+    QuestionMetrics.last_computed,
+    QuestionMetrics.updated_at,
+)
+
+def metrics_to_dict(m):
+    """Serialize a QuestionMetrics instance or a Row selected with METRICS_DICT_COLUMNS"""
+    return {
+        "question_id": m.question_id,
+        "dynamicMetrics": {
+            "globalSuccessRate": round(m.global_success_rate, 3),
+            "totalAttempts": m.total_attempts,
+            "averageResponseTime": round(m.average_response_time, 1),
+            "reachRate": round(m.reach_rate, 3),
+            "difficultyScore": round(m.difficulty_score, 3),
+            "computedAt": m.last_computed.isoformat(),
+            "sampleSize": m.total_attempts,
+            "confidenceInterval": {
+                "lower": round(m.confidence_lower, 3),
+                "upper": round(m.confidence_upper, 3)
+            }
+        },
+        "computedDifficulty": m.computed_difficulty,
+        "lastUpdated": m.updated_at.isoformat() if m.updated_at else None
+    }
 
 class StudentResponse(Base):
     """Store student responses for difficulty calculation"""
@@ -79,6 +106,13 @@ class StudentResponse(Base):
     
     # Timestamps
     created_at = Column(DateTime, server_default=func.now(), index=True)
+
+    # Expression index for the per-day rollup in /api/difficulty/stats/global
+    __table_args__ = (
+        Index("ix_student_responses_created_date", func.date(created_at)),
+        # Range seek for the per-question aggregates over the last N days
+        Index("ix_student_responses_created_question", "created_at", "question_id"),
+    )
     
     def to_dict(self):
         """Convert to dictionary"""
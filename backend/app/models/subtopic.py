@@ -21,12 +21,14 @@ class Subtopic(Base):
     topic = relationship("Topic", back_populates="subtopics")
     questions = relationship("Question", back_populates="subtopic_rel", cascade="all, delete-orphan")
 
-    def to_dict(self, include_topic=False):
-        # Safely get question count - avoid lazy loading in async context
-        try:
-            question_count = len(self.questions) if self.questions else 0
-        except Exception:
-            question_count = 0
+    def to_dict(self, include_topic=False, question_count=None):
+        # Prefer a precomputed count; otherwise safely count loaded questions
+        # - avoid lazy loading in async context
+        if question_count is None:
+            try:
+                question_count = len(self.questions) if self.questions else 0
+            except Exception:
+                question_count = 0
 
         result = {
             "id": self.id,
@@ -22,6 +22,10 @@ class UserDB(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
+# Column subsets for hot auth queries (used with load_only)
+USER_PROFILE_COLUMNS = (UserDB.uid, UserDB.email, UserDB.display_name, UserDB.email_verified)
+USER_LOGIN_COLUMNS = USER_PROFILE_COLUMNS + (UserDB.username, UserDB.password_hash)
+
 class UserCreate(BaseModel):
     email: str
     username: str
@@ -3,24 +3,66 @@ Admin API endpoints for managing courses, topics, subtopics, knowledge types, an
 """
 from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, Query, Request
-from sqlalchemy import select, func
+from sqlalchemy import select, func, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 from pydantic import BaseModel
+import asyncio
 import uuid
 
 from ..db import get_session
-from ..models import Course, Topic, Subtopic, KnowledgeType, Question, DEFAULT_KNOWLEDGE_TYPES
-from ..models.user_role import UserRole
+from ..models import Course, Topic, Subtopic, KnowledgeType, Question, DEFAULT_KNOWLEDGE_TYPES, GeminiAnalysisRecord
 from ..auth.jwt_handler import verify_token
-from ..services.gemini_service import analyze_question
+from ..services.gemini_service import analyze_question, analyze_questions_batch, load_course_taxonomy
+from ..services.quiz_cache import invalidate_quiz_cache
+
+# Celery is only installed alongside the worker; without it the queued
+# analysis endpoints answer 503 and the synchronous ones still work. Tasks are
+# sent by name so the API never imports the worker modules.
+try:
+    from ..tasks.client import celery_client, ANALYZE_QUESTIONS_TASK, GEMINI_QUEUE
+    GEMINI_QUEUE_AVAILABLE = True
+except ImportError:
+    GEMINI_QUEUE_AVAILABLE = False
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
+# Request field name -> column name for PUT payloads
+_FIELD_MAP = {
+    "displayName": "display_name",
+    "isActive": "is_active",
+    "courseId": "course_id",
+    "topicId": "topic_id",
+    "subtopicId": "subtopic_id",
+    "knowledgeTypeId": "knowledge_type_id",
+    "correctAnswer": "correct_answer",
+    "matchPairs": "match_pairs",
+}
+
+
+def _update_values(data: BaseModel) -> dict:
+    """Build column values from the fields actually sent in an update payload"""
+    payload = data.model_dump(exclude_unset=True, exclude_none=True)
+    return {_FIELD_MAP.get(k, k): v for k, v in payload.items()}
+
+
+async def _apply_update(db: AsyncSession, model, entity_id: int, data: BaseModel) -> bool:
+    """Apply an update payload with a single UPDATE; returns False if the row doesn't exist"""
+    values = _update_values(data)
+    if not values:
+        result = await db.execute(select(model.id).where(model.id == entity_id))
+        return result.scalar_one_or_none() is not None
+
+    result = await db.execute(update(model).where(model.id == entity_id).values(**values))
+    if result.rowcount == 0:
+        return False
+    await db.commit()
+    return True
+
 
 # ============ Auth Middleware ============
-async def get_admin_user(request: Request, db: AsyncSession = Depends(get_session)):
-    """Verify admin access"""
+async def get_admin_user(request: Request):
+    """Verify admin access from the token's role claim (no DB lookup)"""
     auth_header = request.headers.get("authorization")
     if not auth_header or not auth_header.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Missing or invalid token")
@@ -30,18 +72,24 @@ async def get_admin_user(request: Request, db: AsyncSession = Depends(get_sessio
     if not payload:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-    # Check admin role
-    uid = payload.get("uid")
-    result = await db.execute(
-        select(UserRole).filter(UserRole.user_uid == uid, UserRole.role == "admin")
-    )
-    admin_role = result.scalar_one_or_none()
-    if not admin_role:
+    # Role is embedded at admin login; tokens are short-lived so revocation propagates
+    if payload.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Admin privileges required")
 
     return payload
 
 
+def _subtopic_question_count():
+    """Correlated COUNT of a subtopic's questions, used instead of loading them"""
+    return (
+        select(func.count(Question.id))
+        .where(Question.subtopic_id == Subtopic.id)
+        .correlate(Subtopic)
+        .scalar_subquery()
+        .label("question_count")
+    )
+
+
 # ============ Pydantic Models ============
 class CourseCreate(BaseModel):
     name: str
@@ -191,27 +239,15 @@ async def update_course(
     admin: dict = Depends(get_admin_user)
 ):
     """Update a course"""
+    if not await _apply_update(db, Course, course_id, data):
+        raise HTTPException(status_code=404, detail="Course not found")
+
     result = await db.execute(
         select(Course)
         .options(selectinload(Course.topics))
         .where(Course.id == course_id)
     )
-    course = result.scalar_one_or_none()
-    if not course:
-        raise HTTPException(status_code=404, detail="Course not found")
-
-    if data.name is not None:
-        course.name = data.name
-    if data.displayName is not None:
-        course.display_name = data.displayName
-    if data.description is not None:
-        course.description = data.description
-    if data.isActive is not None:
-        course.is_active = data.isActive
-
-    await db.commit()
-    await db.refresh(course)
-    return course.to_dict()
+    return result.scalar_one().to_dict()
 
 
 @router.delete("/courses/{course_id}")
@@ -302,29 +338,15 @@ async def update_topic(
     admin: dict = Depends(get_admin_user)
 ):
     """Update a topic"""
+    if not await _apply_update(db, Topic, topic_id, data):
+        raise HTTPException(status_code=404, detail="Topic not found")
+
     result = await db.execute(
         select(Topic)
         .options(selectinload(Topic.subtopics))
         .where(Topic.id == topic_id)
     )
-    topic = result.scalar_one_or_none()
-    if not topic:
-        raise HTTPException(status_code=404, detail="Topic not found")
-
-    if data.courseId is not None:
-        topic.course_id = data.courseId
-    if data.name is not None:
-        topic.name = data.name
-    if data.displayName is not None:
-        topic.display_name = data.displayName
-    if data.description is not None:
-        topic.description = data.description
-    if data.isActive is not None:
-        topic.is_active = data.isActive
-
-    await db.commit()
-    await db.refresh(topic)
-    return topic.to_dict()
+    return result.scalar_one().to_dict()
 
 
 @router.delete("/topics/{topic_id}")
@@ -354,9 +376,8 @@ async def get_subtopics(
     admin: dict = Depends(get_admin_user)
 ):
     """Get all subtopics, optionally filtered by topic or course"""
-    stmt = select(Subtopic).options(
-        selectinload(Subtopic.topic).selectinload(Topic.course),
-        selectinload(Subtopic.questions)
+    stmt = select(Subtopic, _subtopic_question_count()).options(
+        selectinload(Subtopic.topic).selectinload(Topic.course)
     )
     if topic_id:
         stmt = stmt.where(Subtopic.topic_id == topic_id)
@@ -367,8 +388,11 @@ async def get_subtopics(
     stmt = stmt.order_by(Subtopic.name)
 
     result = await db.execute(stmt)
-    subtopics = result.scalars().all()
-    return {"subtopics": [s.to_dict(include_topic=True) for s in subtopics]}
+    return {
+        "subtopics": [
+            s.to_dict(include_topic=True, question_count=count) for s, count in result.all()
+        ]
+    }
 
 
 @router.get("/subtopics/{subtopic_id}")
@@ -421,29 +445,14 @@ async def update_subtopic(
     admin: dict = Depends(get_admin_user)
 ):
     """Update a subtopic"""
-    result = await db.execute(
-        select(Subtopic)
-        .options(selectinload(Subtopic.questions))
-        .where(Subtopic.id == subtopic_id)
-    )
-    subtopic = result.scalar_one_or_none()
-    if not subtopic:
+    if not await _apply_update(db, Subtopic, subtopic_id, data):
         raise HTTPException(status_code=404, detail="Subtopic not found")
 
-    if data.topicId is not None:
-        subtopic.topic_id = data.topicId
-    if data.name is not None:
-        subtopic.name = data.name
-    if data.displayName is not None:
-        subtopic.display_name = data.displayName
-    if data.description is not None:
-        subtopic.description = data.description
-    if data.isActive is not None:
-        subtopic.is_active = data.isActive
-
-    await db.commit()
-    await db.refresh(subtopic)
-    return subtopic.to_dict()
+    result = await db.execute(
+        select(Subtopic, _subtopic_question_count()).where(Subtopic.id == subtopic_id)
+    )
+    subtopic, question_count = result.one()
+    return subtopic.to_dict(question_count=question_count)
 
 
 @router.delete("/subtopics/{subtopic_id}")
@@ -512,23 +521,11 @@ async def update_knowledge_type(
     admin: dict = Depends(get_admin_user)
 ):
     """Update a knowledge type"""
-    result = await db.execute(select(KnowledgeType).where(KnowledgeType.id == kt_id))
-    kt = result.scalar_one_or_none()
-    if not kt:
+    if not await _apply_update(db, KnowledgeType, kt_id, data):
         raise HTTPException(status_code=404, detail="Knowledge type not found")
 
-    if data.name is not None:
-        kt.name = data.name
-    if data.displayName is not None:
-        kt.display_name = data.displayName
-    if data.description is not None:
-        kt.description = data.description
-    if data.isActive is not None:
-        kt.is_active = data.isActive
-
-    await db.commit()
-    await db.refresh(kt)
-    return kt.to_dict()
+    result = await db.execute(select(KnowledgeType).where(KnowledgeType.id == kt_id))
+    return result.scalar_one().to_dict()
 
 
 @router.post("/knowledge-types/seed")
@@ -642,24 +639,25 @@ async def create_question(
     admin: dict = Depends(get_admin_user)
 ):
     """Create a new question"""
-    # Validate subtopic exists
-    subtopic_result = await db.execute(
-        select(Subtopic)
-        .options(selectinload(Subtopic.topic).selectinload(Topic.course))
+    # Validate subtopic and knowledge type in one round-trip; the outer join
+    # leaves kt_id NULL when only the knowledge type is missing
+    lookup = await db.execute(
+        select(Course.name, Topic.name, KnowledgeType.id.label("kt_id"))
+        .select_from(Subtopic)
+        .join(Topic, Subtopic.topic_id == Topic.id)
+        .join(Course, Topic.course_id == Course.id)
+        .outerjoin(KnowledgeType, KnowledgeType.id == data.knowledgeTypeId)
         .where(Subtopic.id == data.subtopicId)
     )
-    subtopic = subtopic_result.scalar_one_or_none()
-    if not subtopic:
+    row = lookup.first()
+    if row is None:
         raise HTTPException(status_code=404, detail="Subtopic not found")
-
-    # Validate knowledge type exists
-    kt_result = await db.execute(select(KnowledgeType).where(KnowledgeType.id == data.knowledgeTypeId))
-    knowledge_type = kt_result.scalar_one_or_none()
-    if not knowledge_type:
+    course_name, topic_name, kt_id = row
+    if kt_id is None:
         raise HTTPException(status_code=404, detail="Knowledge type not found")
 
     # Generate question_id
-    question_id = f"{subtopic.topic.course.name}_{subtopic.topic.name}_{data.type}_{uuid.uuid4().hex[:8]}"
+    question_id = f"{course_name}_{topic_name}_{data.type}_{uuid.uuid4().hex[:8]}"
 
     question = Question(
         question_id=question_id,
@@ -676,6 +674,7 @@ async def create_question(
     )
     db.add(question)
     await db.commit()
+    invalidate_quiz_cache()
     await db.refresh(question)
     return question.to_dict()
 
@@ -688,50 +687,30 @@ async def update_question(
     admin: dict = Depends(get_admin_user)
 ):
     """Update a question"""
-    result = await db.execute(select(Question).where(Question.id == question_id))
-    question = result.scalar_one_or_none()
-    if not question:
+    # Question-not-found takes precedence over invalid subtopic/knowledge type
+    exists = await db.execute(select(Question.id).where(Question.id == question_id))
+    if exists.scalar_one_or_none() is None:
         raise HTTPException(status_code=404, detail="Question not found")
 
     if data.subtopicId is not None:
         # Validate subtopic exists
         subtopic_result = await db.execute(
-            select(Subtopic).where(Subtopic.id == data.subtopicId)
+            select(Subtopic.id).where(Subtopic.id == data.subtopicId)
         )
-        subtopic = subtopic_result.scalar_one_or_none()
-        if not subtopic:
+        if subtopic_result.scalar_one_or_none() is None:
             raise HTTPException(status_code=404, detail="Subtopic not found")
-        question.subtopic_id = data.subtopicId
 
     if data.knowledgeTypeId is not None:
-        kt_result = await db.execute(select(KnowledgeType).where(KnowledgeType.id == data.knowledgeTypeId))
-        kt = kt_result.scalar_one_or_none()
-        if not kt:
+        kt_result = await db.execute(select(KnowledgeType.id).where(KnowledgeType.id == data.knowledgeTypeId))
+        if kt_result.scalar_one_or_none() is None:
             raise HTTPException(status_code=404, detail="Knowledge type not found")
-        question.knowledge_type_id = data.knowledgeTypeId
-
-    if data.type is not None:
-        question.type = data.type
-    if data.text is not None:
-        question.text = data.text
-    if data.options is not None:
-        question.options = data.options
-    if data.correctAnswer is not None:
-        question.correct_answer = data.correctAnswer
-    if data.explanation is not None:
-        question.explanation = data.explanation
-    if data.matchPairs is not None:
-        question.match_pairs = data.matchPairs
-    if data.points is not None:
-        question.points = data.points
-    if data.tags is not None:
-        question.tags = data.tags
-    if data.isActive is not None:
-        question.is_active = data.isActive
 
-    await db.commit()
-    await db.refresh(question)
-    return question.to_dict()
+    if not await _apply_update(db, Question, question_id, data):
+        raise HTTPException(status_code=404, detail="Question not found")
+    invalidate_quiz_cache()
+
+    result = await db.execute(select(Question).where(Question.id == question_id))
+    return result.scalar_one().to_dict()
 
 
 @router.delete("/questions/{question_id}")
@@ -748,6 +727,7 @@ async def delete_question(
 
     question.is_active = False
     await db.commit()
+    invalidate_quiz_cache()
     return {"message": "Question deleted successfully"}
 
 
@@ -797,6 +777,24 @@ class AIAnalyzeRequest(BaseModel):
     questionText: str
 
 
+class AIAnalyzeBatchRequest(BaseModel):
+    courseId: int
+    questionTexts: List[str]
+
+
+class AIAnalyzeQueueRequest(BaseModel):
+    courseId: int
+    questionIds: List[int]
+
+
+async def _load_ai_taxonomy(db: AsyncSession, course_id: int):
+    """Course plus the topic/subtopic/knowledge-type lists the AI prompt is built from"""
+    taxonomy = await load_course_taxonomy(db, course_id)
+    if taxonomy is None:
+        raise HTTPException(status_code=404, detail="Course not found")
+    return taxonomy
+
+
 @router.post("/questions/analyze")
 async def analyze_question_with_ai(
     data: AIAnalyzeRequest,
@@ -804,29 +802,7 @@ async def analyze_question_with_ai(
     admin: dict = Depends(get_admin_user)
 ):
     """Analyze a question using AI and suggest categorization"""
-    # Get course info
-    course_result = await db.execute(select(Course).where(Course.id == data.courseId))
-    course = course_result.scalar_one_or_none()
-    if not course:
-        raise HTTPException(status_code=404, detail="Course not found")
-
-    # Get existing topics for this course
-    topics_result = await db.execute(
-        select(Topic).where(Topic.course_id == data.courseId, Topic.is_active == True)
-    )
-    topics = [{"id": t.id, "name": t.name, "displayName": t.display_name} for t in topics_result.scalars().all()]
-
-    # Get existing subtopics for this course
-    subtopics_result = await db.execute(
-        select(Subtopic)
-        .join(Topic)
-        .where(Topic.course_id == data.courseId, Subtopic.is_active == True)
-    )
-    subtopics = [{"id": s.id, "topicId": s.topic_id, "name": s.name, "displayName": s.display_name} for s in subtopics_result.scalars().all()]
-
-    # Get all knowledge types
-    kt_result = await db.execute(select(KnowledgeType).where(KnowledgeType.is_active == True))
-    knowledge_types = [{"id": k.id, "name": k.name, "displayName": k.display_name, "description": k.description or ""} for k in kt_result.scalars().all()]
+    course, topics, subtopics, knowledge_types = await _load_ai_taxonomy(db, data.courseId)
 
     # Analyze with Gemini
     result = await analyze_question(
@@ -840,6 +816,67 @@ async def analyze_question_with_ai(
     return result
 
 
+@router.post("/questions/analyze/batch")
+async def analyze_questions_with_ai(
+    data: AIAnalyzeBatchRequest,
+    db: AsyncSession = Depends(get_session),
+    admin: dict = Depends(get_admin_user)
+):
+    """Analyze many questions for an import; several questions share each AI call"""
+    course, topics, subtopics, knowledge_types = await _load_ai_taxonomy(db, data.courseId)
+
+    results = await analyze_questions_batch(
+        question_texts=data.questionTexts,
+        course_name=course.display_name,
+        existing_topics=topics,
+        existing_subtopics=subtopics,
+        existing_knowledge_types=knowledge_types
+    )
+
+    return {"results": results}
+
+
+@router.post("/questions/analyze/queue", status_code=202)
+async def queue_question_analysis(
+    data: AIAnalyzeQueueRequest,
+    admin: dict = Depends(get_admin_user)
+):
+    """Queue AI analysis of stored questions on the Gemini worker; poll with the returned task id"""
+    if not GEMINI_QUEUE_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Background analysis is not available")
+
+    # send_task() talks to the broker synchronously
+    task = await asyncio.to_thread(
+        celery_client.send_task,
+        ANALYZE_QUESTIONS_TASK,
+        args=[data.courseId, data.questionIds],
+        queue=GEMINI_QUEUE,
+    )
+    return {"taskId": task.id}
+
+
+@router.get("/questions/analyze/queue/{task_id}")
+async def get_queued_question_analysis(
+    task_id: str,
+    db: AsyncSession = Depends(get_session),
+    admin: dict = Depends(get_admin_user)
+):
+    """Task state plus the analyses it has stored"""
+    if not GEMINI_QUEUE_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Background analysis is not available")
+
+    state = await asyncio.to_thread(lambda: celery_client.AsyncResult(task_id).state)
+    rows = await db.execute(
+        select(GeminiAnalysisRecord.question_id, GeminiAnalysisRecord.result)
+        .where(GeminiAnalysisRecord.task_id == task_id)
+    )
+    return {
+        "taskId": task_id,
+        "status": state,
+        "results": [{"questionId": question_id, **result} for question_id, result in rows.all()]
+    }
+
+
 @router.post("/questions/ai-create")
 async def create_question_with_ai(
     data: dict,
@@ -915,6 +952,7 @@ async def create_question_with_ai(
     )
     db.add(question)
     await db.commit()
+    invalidate_quiz_cache()
     await db.refresh(question)
 
     return {
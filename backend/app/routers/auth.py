@@ -1,18 +1,31 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import bindparam, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from ..models.user import UserCreate, UserLogin, UserResponse, UserDB, GoogleAuthData
-from ..auth.jwt_handler import create_access_token, verify_token
-from ..auth.password_utils import hash_password, verify_password
+from sqlalchemy.orm import load_only
+from ..models.user import (
+    UserCreate, UserLogin, UserResponse, UserDB, GoogleAuthData,
+    USER_LOGIN_COLUMNS, USER_PROFILE_COLUMNS,
+)
+from ..auth.jwt_handler import create_access_token, verify_token, current_payload
+from ..auth.password_utils import hash_password, verify_password, needs_rehash
 from ..db import get_session
+import asyncio
+import hashlib
+import time
 import uuid
 import os
 from datetime import datetime
+from cachetools import TTLCache
 
 # Google auth imports - lazy load to avoid import errors
 try:
     from google.oauth2 import id_token
     from google.auth.transport import requests as google_requests
+    # Shared transport: its requests.Session keeps the HTTPS connection to
+    # Google's cert endpoint alive across logins
+    _google_request = google_requests.Request()
     GOOGLE_AUTH_AVAILABLE = True
     print("✅ Google auth libraries loaded successfully")
 except ImportError as e:
@@ -22,26 +35,54 @@ except ImportError as e:
 router = APIRouter(prefix="/auth", tags=["authentication"])
 security = HTTPBearer()
 
+# Hot lookups built once at import; with bind parameters the compiled form is
+# reused from the engine's query cache and asyncpg's prepared statement cache
+_LOGIN_STMT = (
+    select(UserDB)
+    .options(load_only(*USER_LOGIN_COLUMNS))
+    .where(UserDB.username == bindparam("username"))
+)
+_USER_BY_EMAIL_STMT = (
+    select(UserDB)
+    .options(load_only(*USER_PROFILE_COLUMNS))
+    .where(UserDB.email == bindparam("email"))
+)
+_USER_BY_UID_STMT = (
+    select(UserDB)
+    .options(load_only(*USER_PROFILE_COLUMNS))
+    .where(UserDB.uid == bindparam("uid"))
+)
+
+# /auth/me responses by uid; cleared on logout
+_user_cache: TTLCache = TTLCache(maxsize=10000, ttl=30)
+
+# Verified Google ID token claims by sha256(token); SPA retries reuse the result
+_google_token_cache: TTLCache = TTLCache(maxsize=5000, ttl=300)
+
+
+async def _verify_google_token(token: str) -> dict:
+    """Verify a Google ID token, reusing a cached result while the token is valid"""
+    key = hashlib.sha256(token.encode()).digest()
+    idinfo = _google_token_cache.get(key)
+    if idinfo is not None and idinfo.get("exp", 0) > time.time():
+        return idinfo
+
+    idinfo = await asyncio.to_thread(
+        id_token.verify_oauth2_token,
+        token,
+        _google_request,
+        os.getenv("GOOGLE_CLIENT_ID")
+    )
+    _google_token_cache[key] = idinfo
+    return idinfo
+
 @router.post("/register", response_model=UserResponse)
 async def register(user_data: UserCreate, db: AsyncSession = Depends(get_session)):
     """Register new user"""
     
-    # Check if email already exists
-    from sqlalchemy import select, or_
-    result = await db.execute(
-        select(UserDB).filter(
-            or_(UserDB.email == user_data.email, UserDB.username == user_data.username)
-        )
-    )
-    existing_user = result.scalar_one_or_none()
-    if existing_user:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Email or username already registered"
-        )
-    
     # Create new user (no password validation)
-    hashed_password = hash_password(user_data.password)
+    # Duplicates are rejected by the unique indexes on email/username
+    hashed_password = await asyncio.to_thread(hash_password, user_data.password)
     user_uid = str(uuid.uuid4())
     
     db_user = UserDB(
@@ -57,7 +98,14 @@ async def register(user_data: UserCreate, db: AsyncSession = Depends(get_session
     )
     
     db.add(db_user)
-    await db.commit()
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email or username already registered"
+        )
     await db.refresh(db_user)
     
     return UserResponse(
@@ -72,8 +120,7 @@ async def login(login_data: UserLogin, db: AsyncSession = Depends(get_session)):
     """Login user and return JWT token"""
     
     # Find user by username
-    from sqlalchemy import select
-    result = await db.execute(select(UserDB).filter(UserDB.username == login_data.username))
+    result = await db.execute(_LOGIN_STMT, {"username": login_data.username})
     user = result.scalar_one_or_none()
     if not user:
         raise HTTPException(
@@ -82,17 +129,23 @@ async def login(login_data: UserLogin, db: AsyncSession = Depends(get_session)):
         )
     
     # Verify password
-    if not verify_password(login_data.password, user.password_hash):
+    if not await asyncio.to_thread(verify_password, login_data.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid credentials"
         )
+
+    # Transparently migrate legacy bcrypt hashes to argon2id
+    if needs_rehash(user.password_hash):
+        user.password_hash = await asyncio.to_thread(hash_password, login_data.password)
+        await db.commit()
     
     # Create access token
     token_data = {
         "uid": user.uid,
         "email": user.email,
-        "display_name": user.display_name
+        "display_name": user.display_name,
+        "email_verified": user.email_verified
     }
     access_token = create_access_token(token_data)
     
@@ -120,19 +173,14 @@ async def google_auth(auth_data: GoogleAuthData, db: AsyncSession = Depends(get_
 
     try:
         # Verify Google ID token
-        idinfo = id_token.verify_oauth2_token(
-            auth_data.id_token,
-            google_requests.Request(),
-            os.getenv("GOOGLE_CLIENT_ID")
-        )
+        idinfo = await _verify_google_token(auth_data.id_token)
         
         email = idinfo['email']
         google_id = idinfo['sub']
         name = idinfo.get('name', '')
         
         # Check if user exists
-        from sqlalchemy import select
-        result = await db.execute(select(UserDB).filter(UserDB.email == email))
+        result = await db.execute(_USER_BY_EMAIL_STMT, {"email": email})
         user = result.scalar_one_or_none()
         
         if not user:
@@ -155,14 +203,27 @@ async def google_auth(auth_data: GoogleAuthData, db: AsyncSession = Depends(get_
                 email_verified=True
             )
             db.add(user)
-            await db.commit()
-            await db.refresh(user)
+            try:
+                await db.commit()
+            except IntegrityError:
+                # Created concurrently by another request - use that row
+                await db.rollback()
+                result = await db.execute(_USER_BY_EMAIL_STMT, {"email": email})
+                user = result.scalar_one_or_none()
+                if not user:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail="Email or username already registered"
+                    )
+            else:
+                await db.refresh(user)
         
         # Create access token
         token_data = {
             "uid": user.uid,
             "email": user.email,
-            "display_name": user.display_name
+            "display_name": user.display_name,
+            "email_verified": user.email_verified
         }
         access_token = create_access_token(token_data)
         
@@ -183,24 +244,9 @@ async def google_auth(auth_data: GoogleAuthData, db: AsyncSession = Depends(get_
             detail="Invalid Google token"
         )
 
-@router.get("/me", response_model=UserResponse)
-async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: AsyncSession = Depends(get_session)
-):
-    """Get current user info"""
-    
-    # Verify token
-    payload = verify_token(credentials.credentials)
-    if not payload:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid token"
-        )
-    
-    # Get user from database
-    from sqlalchemy import select
-    result = await db.execute(select(UserDB).filter(UserDB.uid == payload.get("uid")))
+async def _fetch_user_response(db: AsyncSession, uid: str) -> UserResponse:
+    """Load the user row backing a token"""
+    result = await db.execute(_USER_BY_UID_STMT, {"uid": uid})
     user = result.scalar_one_or_none()
     if not user:
         raise HTTPException(
@@ -215,6 +261,40 @@ async def get_current_user(
         email_verified=user.email_verified
     )
 
+@router.get("/me", response_model=UserResponse)
+async def get_current_user(
+    payload: dict = Depends(current_payload),
+    db: AsyncSession = Depends(get_session)
+):
+    """Get current user info from the signed token claims"""
+    
+    if "email_verified" in payload:
+        return UserResponse(
+            uid=payload["uid"],
+            email=payload["email"],
+            display_name=payload.get("display_name"),
+            email_verified=payload["email_verified"]
+        )
+    
+    # Tokens issued before email_verified was a claim
+    uid = payload.get("uid")
+    cached = _user_cache.get(uid)
+    if cached is not None:
+        return cached
+
+    response = await _fetch_user_response(db, uid)
+    _user_cache[uid] = response
+    return response
+
+@router.get("/me/full", response_model=UserResponse)
+async def get_current_user_full(
+    payload: dict = Depends(current_payload),
+    db: AsyncSession = Depends(get_session)
+):
+    """Get current user info straight from the database"""
+    
+    return await _fetch_user_response(db, payload.get("uid"))
+
 @router.post("/logout")
 async def logout(
     credentials: HTTPAuthorizationCredentials = Depends(security)
@@ -223,5 +303,8 @@ async def logout(
     
     # Since we're using stateless JWT tokens, logout is handled client-side
     # The token will expire based on its expiration time
+    payload = verify_token(credentials.credentials)
+    if payload:
+        _user_cache.pop(payload.get("uid"), None)
     
     return {"message": "Logged out successfully"}
\ No newline at end of file
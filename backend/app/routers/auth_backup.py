@@ -1,10 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from ..models.user import UserCreate, UserLogin, UserResponse, UserDB, GoogleAuthData
-from ..auth.jwt_handler import create_access_token, verify_token
-from ..auth.password_utils import hash_password, verify_password
+from sqlalchemy.orm import load_only
+from ..models.user import (
+    UserCreate, UserLogin, UserResponse, UserDB, GoogleAuthData,
+    USER_LOGIN_COLUMNS, USER_PROFILE_COLUMNS,
+)
+from ..auth.jwt_handler import create_access_token, current_payload
+from ..auth.password_utils import hash_password, verify_password, needs_rehash
 from ..db import get_session
+import asyncio
 import uuid
 import os
 from datetime import datetime
@@ -14,22 +20,16 @@ from google.auth.transport import requests
 router = APIRouter(prefix="/auth", tags=["authentication"])
 security = HTTPBearer()
 
+# Shared Google transport - keeps the HTTPS connection alive between logins
+_google_request = requests.Request()
+
 @router.post("/register", response_model=UserResponse)
 async def register(user_data: UserCreate, db: AsyncSession = Depends(get_session)):
     """Register new user"""
     
-    # Check if user already exists
-    from sqlalchemy import select
-    result = await db.execute(select(UserDB).filter(UserDB.email == user_data.email))
-    existing_user = result.scalar_one_or_none()
-    if existing_user:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Email already registered"
-        )
-    
     # Create new user
-    hashed_password = hash_password(user_data.password)
+    # Duplicates are rejected by the unique index on email
+    hashed_password = await asyncio.to_thread(hash_password, user_data.password)
     user_uid = str(uuid.uuid4())
     
     db_user = UserDB(
@@ -44,7 +44,14 @@ async def register(user_data: UserCreate, db: AsyncSession = Depends(get_session
     )
     
     db.add(db_user)
-    await db.commit()
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered"
+        )
     await db.refresh(db_user)
     
     return UserResponse(
@@ -60,7 +67,7 @@ async def login(login_data: UserLogin, db: AsyncSession = Depends(get_session)):
     
     # Find user by email
     from sqlalchemy import select
-    result = await db.execute(select(UserDB).filter(UserDB.email == login_data.email))
+    result = await db.execute(select(UserDB).options(load_only(*USER_LOGIN_COLUMNS)).filter(UserDB.email == login_data.email))
     user = result.scalar_one_or_none()
     if not user:
         raise HTTPException(
@@ -69,17 +76,23 @@ async def login(login_data: UserLogin, db: AsyncSession = Depends(get_session)):
         )
     
     # Verify password
-    if not verify_password(login_data.password, user.password_hash):
+    if not await asyncio.to_thread(verify_password, login_data.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid credentials"
         )
+
+    # Transparently migrate legacy bcrypt hashes to argon2id
+    if needs_rehash(user.password_hash):
+        user.password_hash = await asyncio.to_thread(hash_password, login_data.password)
+        await db.commit()
     
     # Create access token
     token_data = {
         "uid": user.uid,
         "email": user.email,
-        "display_name": user.display_name
+        "display_name": user.display_name,
+        "email_verified": user.email_verified
     }
     access_token = create_access_token(token_data)
     
@@ -101,9 +114,10 @@ async def google_auth(auth_data: GoogleAuthData, db: AsyncSession = Depends(get_
     
     try:
         # Verify Google ID token
-        idinfo = id_token.verify_oauth2_token(
-            auth_data.id_token, 
-            requests.Request(), 
+        idinfo = await asyncio.to_thread(
+            id_token.verify_oauth2_token,
+            auth_data.id_token,
+            _google_request,
             os.getenv("GOOGLE_CLIENT_ID")
         )
         
@@ -113,7 +127,7 @@ async def google_auth(auth_data: GoogleAuthData, db: AsyncSession = Depends(get_
         
         # Check if user exists
         from sqlalchemy import select
-        result = await db.execute(select(UserDB).filter(UserDB.email == email))
+        result = await db.execute(select(UserDB).options(load_only(*USER_PROFILE_COLUMNS)).filter(UserDB.email == email))
         user = result.scalar_one_or_none()
         
         if not user:
@@ -127,14 +141,27 @@ async def google_auth(auth_data: GoogleAuthData, db: AsyncSession = Depends(get_
                 email_verified=True
             )
             db.add(user)
-            await db.commit()
-            await db.refresh(user)
+            try:
+                await db.commit()
+            except IntegrityError:
+                # Created concurrently by another request - use that row
+                await db.rollback()
+                result = await db.execute(select(UserDB).options(load_only(*USER_PROFILE_COLUMNS)).filter(UserDB.email == email))
+                user = result.scalar_one_or_none()
+                if not user:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail="Email already registered"
+                    )
+            else:
+                await db.refresh(user)
         
         # Create access token
         token_data = {
             "uid": user.uid,
             "email": user.email,
-            "display_name": user.display_name
+            "display_name": user.display_name,
+            "email_verified": user.email_verified
         }
         access_token = create_access_token(token_data)
         
@@ -157,22 +184,14 @@ async def google_auth(auth_data: GoogleAuthData, db: AsyncSession = Depends(get_
 
 @router.get("/me", response_model=UserResponse)
 async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
+    payload: dict = Depends(current_payload),
     db: AsyncSession = Depends(get_session)
 ):
     """Get current user info"""
     
-    # Verify token
-    payload = verify_token(credentials.credentials)
-    if not payload:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid token"
-        )
-    
     # Get user from database
     from sqlalchemy import select
-    result = await db.execute(select(UserDB).filter(UserDB.uid == payload.get("uid")))
+    result = await db.execute(select(UserDB).options(load_only(*USER_PROFILE_COLUMNS)).filter(UserDB.uid == payload.get("uid")))
     user = result.scalar_one_or_none()
     if not user:
         raise HTTPException(
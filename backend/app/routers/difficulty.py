@@ -2,16 +2,20 @@
 API endpoints for difficulty calculation and metrics
 """
 
-from fastapi import APIRouter, HTTPException, BackgroundTasks, Query, Depends
-from sqlalchemy.orm import Session
-from sqlalchemy import text
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Query, Depends, Response, status
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Dict, Optional
+import asyncio
 import logging
 from datetime import datetime, timedelta
 
-from ..database import get_db
+from ..db import get_session, async_engine
 from ..services.difficulty_calculator import difficulty_calculator, DifficultyMetrics
-from ..models.question_metrics import QuestionMetrics, StudentResponse
+from ..services import response_buffer
+from ..models.question_metrics import (
+    QuestionMetrics, StudentResponse, METRICS_DICT_COLUMNS, metrics_to_dict
+)
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/difficulty", tags=["difficulty"])
@@ -20,12 +24,12 @@ router = APIRouter(prefix="/api/difficulty", tags=["difficulty"])
 async def calculate_single_question_difficulty(
     question_id: str,
     days_back: int = Query(30, ge=1, le=365),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_session)
 ):
     """Calculate difficulty for a single question"""
     try:
         metrics = await difficulty_calculator.calculate_question_difficulty(
-            question_id, days_back
+            question_id, days_back, session=db
         )
         
         if not metrics:
@@ -75,14 +79,17 @@ async def calculate_batch_difficulties(
 @router.get("/metrics/{question_id}")
 async def get_question_metrics(
     question_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_session)
 ):
     """Get cached difficulty metrics for a question"""
     try:
-        metrics = db.query(QuestionMetrics).filter(
-            QuestionMetrics.question_id == question_id,
-            QuestionMetrics.is_active == True
-        ).first()
+        result = await db.execute(
+            select(QuestionMetrics).where(
+                QuestionMetrics.question_id == question_id,
+                QuestionMetrics.is_active == True
+            )
+        )
+        metrics = result.scalar_one_or_none()
         
         if not metrics:
             raise HTTPException(
@@ -107,24 +114,22 @@ async def get_batch_metrics(
     question_ids: List[str] = Query(...),
     include_stale: bool = Query(False),
     max_age_days: int = Query(7, ge=1, le=30),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_session)
 ):
     """Get difficulty metrics for multiple questions"""
     try:
-        query = db.query(QuestionMetrics).filter(
+        # Core select of just the serialized columns - no ORM instances per row
+        stmt = select(*METRICS_DICT_COLUMNS).where(
             QuestionMetrics.question_id.in_(question_ids),
             QuestionMetrics.is_active == True
         )
         
         if not include_stale:
             cutoff_date = datetime.now() - timedelta(days=max_age_days)
-            query = query.filter(QuestionMetrics.last_computed >= cutoff_date)
+            stmt = stmt.where(QuestionMetrics.last_computed >= cutoff_date)
         
-        metrics = query.all()
-        
-        results = {}
-        for metric in metrics:
-            results[metric.question_id] = metric.to_dict()
+        rows = (await db.execute(stmt)).all()
+        results = {row.question_id: metrics_to_dict(row) for row in rows}
         
         # Identify missing metrics
         missing_questions = set(question_ids) - set(results.keys())
@@ -144,9 +149,15 @@ async def get_batch_metrics(
 @router.post("/responses/submit")
 async def submit_student_response(
     response_data: dict,
-    db: Session = Depends(get_db)
+    http_response: Response,
+    flush: bool = Query(False, description="Write immediately instead of batching"),
+    db: AsyncSession = Depends(get_session)
 ):
-    """Submit student response for difficulty calculation"""
+    """Submit student response for difficulty calculation
+
+    Responses are buffered and inserted in batches; pass flush=true when the
+    caller needs the row (and its id) persisted before the request returns.
+    """
     try:
         # Validate required fields
         required_fields = ['user_id', 'question_id', 'is_correct', 'response_time_ms']
@@ -157,23 +168,39 @@ async def submit_student_response(
                     detail=f"Missing required field: {field}"
                 )
         
-        # Create response record
-        response = StudentResponse(
-            user_id=response_data['user_id'],
-            question_id=response_data['question_id'],
-            is_correct=response_data['is_correct'],
-            response_time_ms=response_data['response_time_ms'],
-            user_answer=response_data.get('user_answer'),
-            user_confidence=response_data.get('user_confidence'),
-            session_id=response_data.get('session_id'),
-            course=response_data.get('course'),
-            topic=response_data.get('topic'),
-            knowledge_type=response_data.get('knowledge_type')
-        )
+        row = {
+            "user_id": response_data['user_id'],
+            "question_id": response_data['question_id'],
+            "is_correct": response_data['is_correct'],
+            "response_time_ms": response_data['response_time_ms'],
+            "user_answer": response_data.get('user_answer'),
+            "user_confidence": response_data.get('user_confidence'),
+            "session_id": response_data.get('session_id'),
+            "course": response_data.get('course'),
+            "topic": response_data.get('topic'),
+            "knowledge_type": response_data.get('knowledge_type'),
+        }
+        
+        # Cached metrics are invalidated once the row is committed (the buffer
+        # does it per written batch), so a concurrent read can't re-cache stale data
+        if not flush:
+            try:
+                response_buffer.enqueue(row)
+            except asyncio.QueueFull:
+                # Writes are backed up (e.g. database outage); the client retries later
+                raise HTTPException(status_code=503, detail="Response buffer is full, try again later")
+            http_response.status_code = status.HTTP_202_ACCEPTED
+            return {
+                "success": True,
+                "message": "Response queued",
+                "queued": True
+            }
         
-        db.add(response)
-        db.commit()
-        db.refresh(response)
+        # Create response record
+        response = StudentResponse(**row)
+        async with db.begin():
+            db.add(response)
+        difficulty_calculator.invalidate_question(row["question_id"])
         
         return {
             "success": True,
@@ -185,13 +212,11 @@ async def submit_student_response(
         raise
     except Exception as e:
         logger.error(f"Error submitting response: {e}")
-        db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/stats/global")
 async def get_global_difficulty_stats(
-    days_back: int = Query(30, ge=1, le=365),
-    db: Session = Depends(get_db)
+    days_back: int = Query(30, ge=1, le=365)
 ):
     """Get global difficulty statistics"""
     try:
@@ -210,11 +235,6 @@ async def get_global_difficulty_stats(
             WHERE created_at >= :cutoff_date
         """)
         
-        result = db.execute(query, {"cutoff_date": cutoff_date}).fetchone()
-        
-        if not result:
-            raise HTTPException(status_code=404, detail="No data found")
-        
         # Difficulty distribution
         difficulty_dist_query = text("""
             SELECT 
@@ -226,7 +246,17 @@ async def get_global_difficulty_stats(
             GROUP BY computed_difficulty
         """)
         
-        difficulty_dist = db.execute(difficulty_dist_query).fetchall()
+        # Both aggregates are independent - run them on two pooled connections at once
+        async with async_engine.connect() as stats_conn, async_engine.connect() as dist_conn:
+            stats_result, dist_result = await asyncio.gather(
+                stats_conn.execute(query, {"cutoff_date": cutoff_date}),
+                dist_conn.execute(difficulty_dist_query),
+            )
+            result = stats_result.fetchone()
+            difficulty_dist = dist_result.fetchall()
+        
+        if not result:
+            raise HTTPException(status_code=404, detail="No data found")
         
         return {
             "success": True,
@@ -1,62 +1,66 @@
 """
 Quiz API endpoints for MAB Quiz app
 """
+import importlib
+import logging
 from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy import select, func
+from sqlalchemy import select, func, lambda_stmt, union_all, literal, null, cast, String
 from sqlalchemy.ext.asyncio import AsyncSession
-import json
 
 from ..db import get_session
-from ..models.question import Question
+from ..models import Course, Topic, Subtopic, Question, QuestionMetrics
+from ..services.quiz_cache import subjects_cache, stats_cache, SUBJECTS_KEY, STATS_KEY
+
+logger = logging.getLogger(__name__)
 
 # Main router
 router = APIRouter(prefix="/api/v1", tags=["quiz"])
 
-print("🔧 Attempting to import auth router...")
-try:
-    from .auth import router as auth_router
-    print("✅ Auth router imported successfully")
-    router.include_router(auth_router)  # auth router will be included under /api/v1
-    print("✅ Auth router registered successfully")
-except ImportError as e:
-    print(f"❌ Auth router import failed: {e}")
-    import traceback
-    print(f"❌ Full traceback: {traceback.format_exc()}")
-except Exception as e:
-    print(f"❌ Error registering auth router: {e}")
-    import traceback
-    print(f"❌ Full traceback: {traceback.format_exc()}")
+# Sub-routers mounted under /api/v1 (admin adds its own /admin prefix);
+# a router that fails to import is logged and skipped
+for _name in ("auth", "sync", "admin"):
+    try:
+        router.include_router(importlib.import_module(f".{_name}", __package__).router)
+    except Exception:
+        logger.exception("Failed to register %s router", _name)
+
+# Eski API zorluk adları -> question_metrics.computed_difficulty değerleri
+_DIFFICULTY_LEVELS = {"easy": "beginner", "medium": "intermediate", "hard": "advanced"}
+
 
-print("🔧 Attempting to import sync router...")
-try:
-    from .sync import router as sync_router
-    print("✅ Sync router imported successfully")
-    router.include_router(sync_router)  # sync router will be included under /api/v1
-    print("✅ Sync router registered successfully")
-except ImportError as e:
-    print(f"❌ Sync router import failed: {e}")
-    import traceback
-    print(f"❌ Full traceback: {traceback.format_exc()}")
-except Exception as e:
-    print(f"❌ Error registering sync router: {e}")
-    import traceback
-    print(f"❌ Full traceback: {traceback.format_exc()}")
+def _with_subject_and_difficulty(stmt):
+    """Soru -> alt konu -> konu -> ders zinciri ve (varsa) aktif zorluk metriği"""
+    return (
+        stmt.select_from(Question)
+        .join(Subtopic, Question.subtopic_id == Subtopic.id)
+        .join(Topic, Subtopic.topic_id == Topic.id)
+        .join(Course, Topic.course_id == Course.id)
+        .outerjoin(
+            QuestionMetrics,
+            (QuestionMetrics.question_id == Question.question_id) & (QuestionMetrics.is_active == True),
+        )
+    )
 
-print("🔧 Attempting to import admin router...")
-try:
-    from .admin import router as admin_router
-    print("✅ Admin router imported successfully")
-    router.include_router(admin_router)  # admin router will be included under /api/v1/admin
-    print("✅ Admin router registered successfully")
-except ImportError as e:
-    print(f"❌ Admin router import failed: {e}")
-    import traceback
-    print(f"❌ Full traceback: {traceback.format_exc()}")
-except Exception as e:
-    print(f"❌ Error registering admin router: {e}")
-    import traceback
-    print(f"❌ Full traceback: {traceback.format_exc()}")
+# /questions taban sorgusu: modül yüklenirken bir kez kurulur
+_QUESTIONS_BASE = _with_subject_and_difficulty(
+    select(
+        Question.question_id,
+        Course.name.label("subject"),
+        QuestionMetrics.computed_difficulty.label("difficulty"),
+        Question.type,
+        Question.text,
+        Question.options,
+    )
+).where(Question.is_active == True)
+
+# Aktif sorusu bulunan derslerin id'leri (/subjects)
+_ACTIVE_QUESTION_COURSES = (
+    select(Topic.course_id)
+    .join(Subtopic, Subtopic.topic_id == Topic.id)
+    .join(Question, Question.subtopic_id == Subtopic.id)
+    .where(Question.is_active == True)
+)
 
 @router.get("/health")
 async def health_check():
@@ -66,39 +70,46 @@ async def health_check():
 @router.get("/questions")
 async def get_questions(
     subject: Optional[str] = Query(None, description="Ders konusu (farmakoloji, terminoloji)"),
-    difficulty: Optional[str] = Query(None, description="Zorluk seviyesi (easy, medium, hard)"),
+    difficulty: Optional[str] = Query(None, description="Zorluk seviyesi (easy/beginner, medium/intermediate, hard/advanced)"),
     question_type: Optional[str] = Query(None, description="Soru tipi (multiple_choice, true_false, etc.)"),
     limit: int = Query(10, ge=1, le=50, description="Maksimum soru sayısı"),
     session: AsyncSession = Depends(get_session),
 ):
     """Filtrelere göre sorular getir"""
     try:
-        stmt = select(Question)
+        # subject = ders adı (courses.name), difficulty = hesaplanan zorluk
+        # (question_metrics.computed_difficulty; henüz hesaplanmamışsa None)
+        level = _DIFFICULTY_LEVELS.get(difficulty, difficulty)
+
+        # lambda_stmt: her filtre kombinasyonu bir kez derlenir, değerler parametre olur
+        stmt = lambda_stmt(lambda: _QUESTIONS_BASE)
         
         if subject:
-            stmt = stmt.where(Question.subject == subject)
+            stmt += lambda s: s.where(Course.name == subject)
         if difficulty:
-            stmt = stmt.where(Question.difficulty == difficulty)
+            stmt += lambda s: s.where(QuestionMetrics.computed_difficulty == level)
         if question_type:
-            stmt = stmt.where(Question.type == question_type)
+            stmt += lambda s: s.where(Question.type == question_type)
             
-        stmt = stmt.limit(limit)
+        stmt += lambda s: s.limit(limit)
         
         result = await session.execute(stmt)
-        questions = result.scalars().all()
+        
+        # Tek geçiş: satırlar ara liste olmadan doğrudan yanıt sözlüğüne dönüşür
+        questions = [
+            {
+                "id": q.question_id,
+                "subject": q.subject,
+                "difficulty": q.difficulty,
+                "type": q.type,
+                "text": q.text,
+                "options": q.options or {},
+            }
+            for q in result
+        ]
         
         return {
-            "questions": [
-                {
-                    "id": q.question_id,
-                    "subject": q.subject,
-                    "difficulty": q.difficulty,
-                    "type": q.type,
-                    "text": q.text,
-                    "options": json.loads(q.options_json) if q.options_json else {},
-                }
-                for q in questions
-            ],
+            "questions": questions,
             "count": len(questions)
         }
     except Exception as e:
@@ -107,37 +118,66 @@ async def get_questions(
 @router.get("/subjects")
 async def get_subjects(session: AsyncSession = Depends(get_session)):
     """Mevcut ders konularını getir"""
+    cached = subjects_cache.get(SUBJECTS_KEY)
+    if cached is not None:
+        return cached
     try:
-        stmt = select(Question.subject).distinct()
-        result = await session.execute(stmt)
-        subjects = result.scalars().all()
-        return {"subjects": list(subjects)}
+        # Konu = aktif sorusu olan derslerin adları (courses.name)
+        if session.bind.dialect.name == "postgresql":
+            # Tek skaler: array_agg listeyi satır satır hidrasyon olmadan döndürür
+            stmt = select(func.array_agg(func.distinct(Course.name))).where(Course.id.in_(_ACTIVE_QUESTION_COURSES))
+            subjects = (await session.execute(stmt)).scalar() or []
+        else:
+            stmt = select(Course.name).where(Course.id.in_(_ACTIVE_QUESTION_COURSES)).distinct()
+            subjects = (await session.execute(stmt)).scalars().all()
+        response = {"subjects": list(subjects)}
+        subjects_cache[SUBJECTS_KEY] = response
+        return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Konular alınırken hata: {str(e)}")
 
 @router.get("/stats")
 async def get_quiz_stats(session: AsyncSession = Depends(get_session)):
     """Quiz istatistiklerini getir"""
+    cached = stats_cache.get(STATS_KEY)
+    if cached is not None:
+        return cached
     try:
-        # Toplam soru sayısı
-        total_stmt = select(func.count(Question.id))
-        total_result = await session.execute(total_stmt)
-        total_questions = total_result.scalar()
-        
-        # Konulara göre dağılım
-        subject_stmt = select(Question.subject, func.count(Question.id)).group_by(Question.subject)
-        subject_result = await session.execute(subject_stmt)
-        subject_distribution = {subject: count for subject, count in subject_result.fetchall()}
-        
-        # Zorluk seviyelerine göre dağılım
-        difficulty_stmt = select(Question.difficulty, func.count(Question.id)).group_by(Question.difficulty)
-        difficulty_result = await session.execute(difficulty_stmt)
-        difficulty_distribution = {diff: count for diff, count in difficulty_result.fetchall()}
+        # Toplam, konu (ders) ve zorluk dağılımı tek sorguda; satırlar "k" ile ayrılır.
+        # Zorluğu henüz hesaplanmamış sorular "unrated" altında sayılır.
+        difficulty_label = func.coalesce(QuestionMetrics.computed_difficulty, "unrated")
+        stmt = union_all(
+            select(
+                literal("total").label("k"),
+                cast(null(), String).label("label"),
+                func.count(Question.id).label("c"),
+            ).where(Question.is_active == True),
+            _with_subject_and_difficulty(select(literal("subject"), cast(Course.name, String), func.count(Question.id)))
+            .where(Question.is_active == True)
+            .group_by(Course.name),
+            _with_subject_and_difficulty(select(literal("difficulty"), cast(difficulty_label, String), func.count(Question.id)))
+            .where(Question.is_active == True)
+            .group_by(difficulty_label),
+        )
+        result = await session.execute(stmt)
+
+        total_questions = 0
+        subject_distribution = {}
+        difficulty_distribution = {}
+        for kind, label, count in result.all():
+            if kind == "total":
+                total_questions = count
+            elif kind == "subject":
+                subject_distribution[label] = count
+            else:
+                difficulty_distribution[label] = count
         
-        return {
+        response = {
             "total_questions": total_questions,
             "subjects": subject_distribution,
             "difficulties": difficulty_distribution
         }
+        stats_cache[STATS_KEY] = response
+        return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"İstatistikler alınırken hata: {str(e)}")
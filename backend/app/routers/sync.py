@@ -2,19 +2,38 @@
 Sync API endpoints for MAB state synchronization
 Delta sync strategy: client sends data updated after lastSyncTime
 """
+import time
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import select, and_
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import select, func, bindparam, or_, literal_column
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
+from cachetools import TTLCache
 
 from ..db import get_session
-from ..models.mab_state import UserMABQuestionArm, UserMABTopicArm
+from ..models.mab_state import (
+    UserMABQuestionArm, UserMABTopicArm,
+    QUESTION_ARM_DICT_COLUMNS, TOPIC_ARM_DICT_COLUMNS,
+    question_arm_to_dict, topic_arm_to_dict,
+)
 from ..auth.jwt_handler import get_current_user
 
 router = APIRouter(prefix="/sync", tags=["sync"])
 
+_EPOCH = datetime(1970, 1, 1)
+
+# /sync/mab/status arm counts by user_id; dropped when that user syncs
+_status_cache: TTLCache = TTLCache(maxsize=10000, ttl=5)
+
+
+def _from_epoch_ms(ms: int) -> datetime:
+    """Naive UTC datetime from client epoch ms (plain arithmetic, no tz lookup)"""
+    return _EPOCH + timedelta(milliseconds=ms)
+
 
 # ==================== Request/Response Models ====================
 
@@ -60,6 +79,77 @@ class SyncResponse(BaseModel):
     conflicts_resolved: int = 0
 
 
+# ==================== Bulk Upsert ====================
+
+QUESTION_ARM_UPDATE_COLUMNS = (
+    "attempts", "successes", "failures", "total_response_time_ms",
+    "alpha", "beta", "user_confidence", "last_attempted", "updated_at",
+)
+TOPIC_ARM_UPDATE_COLUMNS = (
+    "attempts", "successes", "failures", "total_response_time_ms",
+    "alpha", "beta", "topic", "knowledge_type", "course", "updated_at",
+)
+# Rows per upsert statement (at most 13 binds each)
+UPSERT_CHUNK_SIZE = 1000
+
+
+async def upsert_arms(
+    session: AsyncSession, model, rows: List[dict], key_columns: List[str], update_columns
+) -> int:
+    """
+    Insert or update arms in one statement with "last write wins" on updated_at.
+    Returns how many existing rows were overwritten (tracked on PostgreSQL only).
+    """
+    if not rows:
+        return 0
+
+    # ON CONFLICT DO UPDATE can't touch the same row twice in one statement:
+    # keep only the newest copy of a key the payload repeats
+    latest = {}
+    for row in rows:
+        key = tuple(row[col] for col in key_columns)
+        if key not in latest or row["updated_at"] > latest[key]["updated_at"]:
+            latest[key] = row
+    rows = list(latest.values())
+
+    is_postgres = session.bind.dialect.name == "postgresql"
+    insert = pg_insert if is_postgres else sqlite_insert
+    overwritten = 0
+    # Chunked to stay under the driver's bind-parameter limit (32767 on asyncpg)
+    for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        stmt = insert(model).values(rows[start:start + UPSERT_CHUNK_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={col: stmt.excluded[col] for col in update_columns},
+            where=or_(model.updated_at.is_(None), stmt.excluded.updated_at > model.updated_at),
+        )
+        if not is_postgres:
+            await session.execute(stmt)
+            continue
+
+        # xmax is 0 for freshly inserted rows; skipped rows (older client data) return nothing
+        result = await session.execute(stmt.returning(literal_column("(xmax = 0)")))
+        overwritten += sum(1 for (inserted,) in result if not inserted)
+    return overwritten
+
+
+# ==================== Delta Queries ====================
+# Built once with bind parameters so the compiled SQL is reused across requests
+
+_QUESTION_ARMS_ALL = select(*QUESTION_ARM_DICT_COLUMNS).where(
+    UserMABQuestionArm.user_id == bindparam("user_id")
+).execution_options(yield_per=500)
+_QUESTION_ARMS_SINCE = _QUESTION_ARMS_ALL.where(
+    UserMABQuestionArm.updated_at > bindparam("since")
+)
+_TOPIC_ARMS_ALL = select(*TOPIC_ARM_DICT_COLUMNS).where(
+    UserMABTopicArm.user_id == bindparam("user_id")
+).execution_options(yield_per=500)
+_TOPIC_ARMS_SINCE = _TOPIC_ARMS_ALL.where(
+    UserMABTopicArm.updated_at > bindparam("since")
+)
+
+
 # ==================== Sync Endpoints ====================
 
 @router.post("/mab", response_model=SyncResponse)
@@ -78,144 +168,83 @@ async def sync_mab_state(
     4. Client updates local DB with server response
     """
     user_id = current_user["user_id"]
-    server_time = int(datetime.utcnow().timestamp() * 1000)
-    last_sync_datetime = datetime.fromtimestamp(request.last_sync_time / 1000) if request.last_sync_time > 0 else None
-    conflicts_resolved = 0
-
-    # ==================== Process Question Arms ====================
-    for arm in request.question_arms:
-        existing = await session.execute(
-            select(UserMABQuestionArm).where(
-                and_(
-                    UserMABQuestionArm.user_id == user_id,
-                    UserMABQuestionArm.question_id == arm.question_id,
-                )
-            )
+    server_time = time.time_ns() // 1_000_000
+    last_sync_datetime = _from_epoch_ms(request.last_sync_time) if request.last_sync_time > 0 else None
+
+    question_rows = [
+        {
+            "user_id": user_id,
+            "question_id": arm.question_id,
+            "attempts": arm.attempts,
+            "successes": arm.successes,
+            "failures": arm.failures,
+            "total_response_time_ms": arm.total_response_time_ms,
+            "alpha": arm.alpha,
+            "beta": arm.beta,
+            "user_confidence": arm.user_confidence,
+            "last_attempted": _from_epoch_ms(arm.last_attempted) if arm.last_attempted else None,
+            "created_at": _from_epoch_ms(arm.created_at),
+            "updated_at": _from_epoch_ms(arm.updated_at),
+        }
+        for arm in request.question_arms
+    ]
+    topic_rows = [
+        {
+            "user_id": user_id,
+            "topic_key": arm.topic_key,
+            "topic": arm.topic,
+            "knowledge_type": arm.knowledge_type,
+            "course": arm.course,
+            "attempts": arm.attempts,
+            "successes": arm.successes,
+            "failures": arm.failures,
+            "total_response_time_ms": arm.total_response_time_ms,
+            "alpha": arm.alpha,
+            "beta": arm.beta,
+            "created_at": _from_epoch_ms(arm.created_at),
+            "updated_at": _from_epoch_ms(arm.updated_at),
+        }
+        for arm in request.topic_arms
+    ]
+
+    # ==================== Merge (last write wins) ====================
+    # Both upserts share one transaction: a single commit, rolled back on error
+    async with session.begin():
+        conflicts_resolved = await upsert_arms(
+            session, UserMABQuestionArm, question_rows, ["user_id", "question_id"], QUESTION_ARM_UPDATE_COLUMNS
         )
-        existing_arm = existing.scalar_one_or_none()
-
-        client_updated = datetime.fromtimestamp(arm.updated_at / 1000)
-
-        if existing_arm:
-            # Conflict resolution: last write wins
-            if existing_arm.updated_at is None or client_updated > existing_arm.updated_at:
-                existing_arm.attempts = arm.attempts
-                existing_arm.successes = arm.successes
-                existing_arm.failures = arm.failures
-                existing_arm.total_response_time_ms = arm.total_response_time_ms
-                existing_arm.alpha = arm.alpha
-                existing_arm.beta = arm.beta
-                existing_arm.user_confidence = arm.user_confidence
-                existing_arm.last_attempted = datetime.fromtimestamp(arm.last_attempted / 1000) if arm.last_attempted else None
-                existing_arm.updated_at = client_updated
-                conflicts_resolved += 1
-        else:
-            # New record
-            new_arm = UserMABQuestionArm(
-                user_id=user_id,
-                question_id=arm.question_id,
-                attempts=arm.attempts,
-                successes=arm.successes,
-                failures=arm.failures,
-                total_response_time_ms=arm.total_response_time_ms,
-                alpha=arm.alpha,
-                beta=arm.beta,
-                user_confidence=arm.user_confidence,
-                last_attempted=datetime.fromtimestamp(arm.last_attempted / 1000) if arm.last_attempted else None,
-                created_at=datetime.fromtimestamp(arm.created_at / 1000),
-                updated_at=client_updated,
-            )
-            session.add(new_arm)
-
-    # ==================== Process Topic Arms ====================
-    for arm in request.topic_arms:
-        existing = await session.execute(
-            select(UserMABTopicArm).where(
-                and_(
-                    UserMABTopicArm.user_id == user_id,
-                    UserMABTopicArm.topic_key == arm.topic_key,
-                )
-            )
+        conflicts_resolved += await upsert_arms(
+            session, UserMABTopicArm, topic_rows, ["user_id", "topic_key"], TOPIC_ARM_UPDATE_COLUMNS
         )
-        existing_arm = existing.scalar_one_or_none()
-
-        client_updated = datetime.fromtimestamp(arm.updated_at / 1000)
-
-        if existing_arm:
-            # Conflict resolution: last write wins
-            if existing_arm.updated_at is None or client_updated > existing_arm.updated_at:
-                existing_arm.attempts = arm.attempts
-                existing_arm.successes = arm.successes
-                existing_arm.failures = arm.failures
-                existing_arm.total_response_time_ms = arm.total_response_time_ms
-                existing_arm.alpha = arm.alpha
-                existing_arm.beta = arm.beta
-                existing_arm.topic = arm.topic
-                existing_arm.knowledge_type = arm.knowledge_type
-                existing_arm.course = arm.course
-                existing_arm.updated_at = client_updated
-                conflicts_resolved += 1
-        else:
-            # New record
-            new_arm = UserMABTopicArm(
-                user_id=user_id,
-                topic_key=arm.topic_key,
-                topic=arm.topic,
-                knowledge_type=arm.knowledge_type,
-                course=arm.course,
-                attempts=arm.attempts,
-                successes=arm.successes,
-                failures=arm.failures,
-                total_response_time_ms=arm.total_response_time_ms,
-                alpha=arm.alpha,
-                beta=arm.beta,
-                created_at=datetime.fromtimestamp(arm.created_at / 1000),
-                updated_at=client_updated,
-            )
-            session.add(new_arm)
-
-    await session.commit()
+    if question_rows or topic_rows:
+        _status_cache.pop(user_id, None)
 
     # ==================== Fetch Server Updates ====================
-    # Get all records updated since client's lastSyncTime
+    # Get all records updated since client's lastSyncTime (first sync: everything)
+    # Only the serialized columns are selected and rows are streamed from a
+    # server-side cursor in chunks, so a large delta (client offline for weeks)
+    # is never hydrated into ORM objects
     if last_sync_datetime:
-        question_arms_result = await session.execute(
-            select(UserMABQuestionArm).where(
-                and_(
-                    UserMABQuestionArm.user_id == user_id,
-                    UserMABQuestionArm.updated_at > last_sync_datetime,
-                )
-            )
-        )
+        params = {"user_id": user_id, "since": last_sync_datetime}
+        question_stmt, topic_stmt = _QUESTION_ARMS_SINCE, _TOPIC_ARMS_SINCE
     else:
-        # First sync - get all records for this user
-        question_arms_result = await session.execute(
-            select(UserMABQuestionArm).where(UserMABQuestionArm.user_id == user_id)
-        )
-    server_question_arms = [arm.to_dict() for arm in question_arms_result.scalars().all()]
+        params = {"user_id": user_id}
+        question_stmt, topic_stmt = _QUESTION_ARMS_ALL, _TOPIC_ARMS_ALL
 
-    if last_sync_datetime:
-        topic_arms_result = await session.execute(
-            select(UserMABTopicArm).where(
-                and_(
-                    UserMABTopicArm.user_id == user_id,
-                    UserMABTopicArm.updated_at > last_sync_datetime,
-                )
-            )
-        )
-    else:
-        # First sync - get all records for this user
-        topic_arms_result = await session.execute(
-            select(UserMABTopicArm).where(UserMABTopicArm.user_id == user_id)
-        )
-    server_topic_arms = [arm.to_dict() for arm in topic_arms_result.scalars().all()]
+    question_arms_result = await session.stream(question_stmt, params)
+    server_question_arms = [question_arm_to_dict(row) async for row in question_arms_result]
+    topic_arms_result = await session.stream(topic_stmt, params)
+    server_topic_arms = [topic_arm_to_dict(row) async for row in topic_arms_result]
 
-    return SyncResponse(
-        server_time=server_time,
-        question_arms=server_question_arms,
-        topic_arms=server_topic_arms,
-        conflicts_resolved=conflicts_resolved,
-    )
+    # Returned as ORJSONResponse directly: the payload already matches
+    # SyncResponse (kept as response_model for the docs), so FastAPI's
+    # per-item re-validation of the arm lists is skipped
+    return ORJSONResponse({
+        "server_time": server_time,
+        "question_arms": server_question_arms,
+        "topic_arms": server_topic_arms,
+        "conflicts_resolved": conflicts_resolved,
+    })
 
 
 @router.get("/mab/status")
@@ -226,19 +255,22 @@ async def get_sync_status(
     """Get user's MAB sync status"""
     user_id = current_user["user_id"]
 
-    question_count = await session.execute(
-        select(UserMABQuestionArm).where(UserMABQuestionArm.user_id == user_id)
-    )
-    question_arms = question_count.scalars().all()
+    counts = _status_cache.get(user_id)
+    if counts is None:
+        # COUNT(*) in the database; no arm rows are loaded
+        question_count = await session.scalar(
+            select(func.count()).select_from(UserMABQuestionArm).where(UserMABQuestionArm.user_id == user_id)
+        )
+        topic_count = await session.scalar(
+            select(func.count()).select_from(UserMABTopicArm).where(UserMABTopicArm.user_id == user_id)
+        )
 
-    topic_count = await session.execute(
-        select(UserMABTopicArm).where(UserMABTopicArm.user_id == user_id)
-    )
-    topic_arms = topic_count.scalars().all()
+        counts = (question_count, topic_count)
+        _status_cache[user_id] = counts
 
     return {
         "user_id": user_id,
-        "question_arms_count": len(question_arms),
-        "topic_arms_count": len(topic_arms),
-        "server_time": int(datetime.utcnow().timestamp() * 1000),
+        "question_arms_count": counts[0],
+        "topic_arms_count": counts[1],
+        "server_time": time.time_ns() // 1_000_000,
     }
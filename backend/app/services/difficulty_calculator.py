@@ -4,16 +4,78 @@ Calculates dynamic question difficulty based on global student performance.
 """
 
 import math
+import re
+import numpy as np
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
-from sqlalchemy import text
-from ..database import get_db
+from contextlib import asynccontextmanager
+from sqlalchemy import bindparam, func, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from cachetools import TTLCache
+from ..db import AsyncSessionLocal
 from ..models import QuestionMetrics
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Question id keyword -> knowledge type, checked in _KNOWLEDGE_TYPE_PRIORITY order
+_KNOWLEDGE_TYPE_KEYWORDS = {
+    'dosage': 'dosage',
+    'dose': 'dosage',
+    'side_effect': 'side_effect',
+    'adverse': 'side_effect',
+    'pharmacodynamics': 'pharmacodynamics',
+    'mechanism': 'pharmacodynamics',
+    'pharmacokinetics': 'pharmacokinetics',
+    'absorption': 'pharmacokinetics',
+    'term': 'terminology',
+}
+_KNOWLEDGE_TYPE_PRIORITY = ('dosage', 'side_effect', 'pharmacodynamics', 'pharmacokinetics', 'terminology')
+_KNOWLEDGE_TYPE_PATTERN = re.compile('|'.join(_KNOWLEDGE_TYPE_KEYWORDS), re.IGNORECASE)
+
+# Wilson score interval z-scores (95% and 90%) and their squares
+_Z95 = 1.96
+_Z95_SQ = _Z95 * _Z95
+_Z90 = 1.645
+_Z90_SQ = _Z90 * _Z90
+
+# Materialized 30-day per-question aggregate (created on app startup and by
+# migrate_tables.py, refreshed by the refresh_difficulty_view Celery task)
+DIFFICULTY_VIEW = "question_difficulty_mv"
+DIFFICULTY_VIEW_DAYS = 30
+DIFFICULTY_VIEW_REFRESH_SECONDS = 600
+
+# The unique index allows REFRESH MATERIALIZED VIEW CONCURRENTLY
+DIFFICULTY_VIEW_STATEMENTS = [
+    f"""
+    CREATE MATERIALIZED VIEW IF NOT EXISTS {DIFFICULTY_VIEW} AS
+    SELECT
+        question_id,
+        COUNT(*) AS total_attempts,
+        SUM(CASE WHEN is_correct THEN 1 ELSE 0 END) AS total_correct,
+        AVG(response_time_ms) AS avg_response_time_ms,
+        COUNT(DISTINCT user_id) AS unique_users
+    FROM student_responses
+    WHERE created_at >= NOW() - INTERVAL '{DIFFICULTY_VIEW_DAYS} days'
+    GROUP BY question_id
+    """,
+    f"CREATE UNIQUE INDEX IF NOT EXISTS ix_{DIFFICULTY_VIEW}_question "
+    f"ON {DIFFICULTY_VIEW} (question_id)",
+]
+
+
+@asynccontextmanager
+async def _session_scope(session: Optional[AsyncSession]):
+    """Use the caller's session when given, otherwise open one from the pool"""
+    if session is not None:
+        yield session
+    else:
+        async with AsyncSessionLocal() as own_session:
+            yield own_session
+
+
 @dataclass
 class DifficultyMetrics:
     """Question difficulty metrics"""
@@ -48,136 +110,229 @@ class DifficultyCalculator:
     
     def __init__(self, min_sample_size: int = 10):
         self.min_sample_size = min_sample_size
+        # Cache-aside for the 30-day aggregate: (question_id, days_back) -> metrics
+        self._metrics_cache: TTLCache = TTLCache(maxsize=10000, ttl=3600)
+        # Metrics read from the materialized view are already up to one refresh
+        # old; never keep them longer than the refresh interval
+        self._view_metrics_cache: TTLCache = TTLCache(maxsize=10000, ttl=DIFFICULTY_VIEW_REFRESH_SECONDS)
+    
+    def invalidate_question(self, question_id: str):
+        """Drop cached metrics for a question after new responses arrive"""
+        for cache in (self._metrics_cache, self._view_metrics_cache):
+            for key in [k for k in cache if k[0] == question_id]:
+                cache.pop(key, None)
     
     async def calculate_question_difficulty(
         self, 
         question_id: str,
-        days_back: int = 30
+        days_back: int = 30,
+        session: Optional[AsyncSession] = None
     ) -> Optional[DifficultyMetrics]:
         """Calculate difficulty for a single question"""
         
+        cache_key = (question_id, days_back)
+        cached = self._metrics_cache.get(cache_key) or self._view_metrics_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
-            db = next(get_db())
-            
-            # Get performance data from last N days
-            cutoff_date = datetime.now() - timedelta(days=days_back)
-            
-            # Query to get aggregated performance data
-            query = text("""
-                SELECT 
-                    question_id,
-                    COUNT(*) as total_attempts,
-                    SUM(CASE WHEN is_correct THEN 1 ELSE 0 END) as total_correct,
-                    AVG(response_time_ms) as avg_response_time_ms,
-                    COUNT(DISTINCT user_id) as unique_users,
-                    AVG(user_confidence) as avg_confidence
-                FROM student_responses 
-                WHERE question_id = :question_id 
-                AND created_at >= :cutoff_date
-                GROUP BY question_id
-            """)
-            
-            result = db.execute(query, {
-                "question_id": question_id,
-                "cutoff_date": cutoff_date
-            }).fetchone()
-            
-            if not result or result.total_attempts < self.min_sample_size:
-                logger.warning(f"Insufficient data for question {question_id}")
-                return None
-            
-            # Calculate basic metrics
-            success_rate = result.total_correct / result.total_attempts
-            avg_response_time = (result.avg_response_time_ms or 30000) / 1000  # Convert to seconds
-            
-            # Calculate reach rate (how many students attempt this question)
-            total_active_students = await self._get_active_students_count(db, days_back)
-            reach_rate = result.unique_users / max(total_active_students, 1)
-            
-            # Calculate confidence interval for success rate
-            confidence_interval = self._calculate_confidence_interval(
-                result.total_correct, 
-                result.total_attempts
-            )
+            async with _session_scope(session) as db:
+                from_view = days_back == DIFFICULTY_VIEW_DAYS and db.bind.dialect.name == "postgresql"
+                if from_view:
+                    # Default window: read the pre-aggregated row (index lookup)
+                    query = text(f"""
+                        SELECT question_id, total_attempts, total_correct,
+                               avg_response_time_ms, unique_users
+                        FROM {DIFFICULTY_VIEW}
+                        WHERE question_id = :question_id
+                    """)
+                    params = {"question_id": question_id}
+                else:
+                    # Get performance data from last N days
+                    cutoff_date = datetime.now() - timedelta(days=days_back)
+                
+                    # Query to get aggregated performance data
+                    query = text("""
+                        SELECT 
+                            question_id,
+                            COUNT(*) as total_attempts,
+                            SUM(CASE WHEN is_correct THEN 1 ELSE 0 END) as total_correct,
+                            AVG(response_time_ms) as avg_response_time_ms,
+                            COUNT(DISTINCT user_id) as unique_users
+                        FROM student_responses 
+                        WHERE question_id = :question_id 
+                        AND created_at >= :cutoff_date
+                        GROUP BY question_id
+                    """)
+                    params = {"question_id": question_id, "cutoff_date": cutoff_date}
             
-            # Calculate composite difficulty score
-            difficulty_score = self._calculate_composite_difficulty(
-                success_rate, 
-                reach_rate, 
-                avg_response_time,
-                question_id
-            )
+                result = (await db.execute(query, params)).first()
             
-            # Determine difficulty category
-            computed_difficulty = self._score_to_difficulty(difficulty_score)
+                if not result or result.total_attempts < self.min_sample_size:
+                    logger.warning(f"Insufficient data for question {question_id}")
+                    return None
             
-            return DifficultyMetrics(
-                question_id=question_id,
-                global_success_rate=success_rate,
-                total_attempts=result.total_attempts,
-                average_response_time=avg_response_time,
-                reach_rate=reach_rate,
-                difficulty_score=difficulty_score,
-                computed_difficulty=computed_difficulty,
-                confidence_interval=confidence_interval,
-                last_computed=datetime.now()
-            )
+                total_active_students = await self._get_active_students_count(db, days_back)
+                metrics = self._metrics_from_row(result, total_active_students)
+                cache = self._view_metrics_cache if from_view else self._metrics_cache
+                cache[cache_key] = metrics
+                return metrics
             
         except Exception as e:
             logger.error(f"Error calculating difficulty for {question_id}: {e}")
             return None
-        finally:
-            db.close()
     
     async def batch_calculate_difficulties(
         self,
         question_ids: List[str] = None,
-        days_back: int = 30
+        days_back: int = 30,
+        session: Optional[AsyncSession] = None
     ) -> Dict[str, DifficultyMetrics]:
         """Calculate difficulties for multiple questions in batch"""
         
         results = {}
         
         try:
-            db = next(get_db())
-            
-            # If no specific questions provided, get all questions with recent activity
-            if not question_ids:
+            async with _session_scope(session) as db:
                 cutoff_date = datetime.now() - timedelta(days=days_back)
-                query = text("""
-                    SELECT DISTINCT question_id 
+                params = {"cutoff_date": cutoff_date, "min_sample_size": self.min_sample_size}
+            
+                # Per-question aggregates for every qualifying question in one query
+                # (no question_ids = all questions with recent activity)
+                id_filter = ""
+                if question_ids:
+                    id_filter = "AND question_id IN :question_ids"
+                    params["question_ids"] = list(question_ids)
+                query = text(f"""
+                    SELECT 
+                        question_id,
+                        COUNT(*) as total_attempts,
+                        SUM(CASE WHEN is_correct THEN 1 ELSE 0 END) as total_correct,
+                        AVG(response_time_ms) as avg_response_time_ms,
+                        COUNT(DISTINCT user_id) as unique_users
                     FROM student_responses 
                     WHERE created_at >= :cutoff_date
+                    {id_filter}
                     GROUP BY question_id
                     HAVING COUNT(*) >= :min_sample_size
                 """)
-                
-                result = db.execute(query, {
-                    "cutoff_date": cutoff_date,
-                    "min_sample_size": self.min_sample_size
-                }).fetchall()
-                
-                question_ids = [row.question_id for row in result]
+                if question_ids:
+                    query = query.bindparams(bindparam("question_ids", expanding=True))
+            
+                rows = (await db.execute(query, params)).all()
+                total_active_students = await self._get_active_students_count(db, days_back)
+            
+                for metrics in self._metrics_from_rows(rows, total_active_students):
+                    results[metrics.question_id] = metrics
+                    self._metrics_cache[(metrics.question_id, days_back)] = metrics
             
-            # Calculate difficulty for each question
-            for question_id in question_ids:
-                metrics = await self.calculate_question_difficulty(question_id, days_back)
-                if metrics:
-                    results[question_id] = metrics
-                    
-                    # Save to database
-                    await self._save_difficulty_metrics(db, metrics)
+                # Save to database
+                await self._save_difficulty_metrics(db, list(results.values()))
             
-            logger.info(f"Calculated difficulties for {len(results)} questions")
+                logger.info(f"Calculated difficulties for {len(results)} questions")
             
         except Exception as e:
             logger.error(f"Error in batch calculation: {e}")
-        finally:
-            if 'db' in locals():
-                db.close()
         
         return results
     
+    def _metrics_from_row(self, row, total_active_students: int) -> DifficultyMetrics:
+        """Build DifficultyMetrics from one aggregated student_responses row"""
+        question_id = row.question_id
+        
+        # Calculate basic metrics
+        success_rate = row.total_correct / row.total_attempts
+        avg_response_time = (row.avg_response_time_ms or 30000) / 1000  # Convert to seconds
+        
+        # Calculate reach rate (how many students attempt this question)
+        reach_rate = row.unique_users / max(total_active_students, 1)
+        
+        # Calculate confidence interval for success rate
+        confidence_interval = self._calculate_confidence_interval(
+            row.total_correct, 
+            row.total_attempts
+        )
+        
+        # Calculate composite difficulty score
+        difficulty_score = self._calculate_composite_difficulty(
+            success_rate, 
+            reach_rate, 
+            avg_response_time,
+            question_id
+        )
+        
+        # Determine difficulty category
+        computed_difficulty = self._score_to_difficulty(difficulty_score)
+        
+        return DifficultyMetrics(
+            question_id=question_id,
+            global_success_rate=success_rate,
+            total_attempts=row.total_attempts,
+            average_response_time=avg_response_time,
+            reach_rate=reach_rate,
+            difficulty_score=difficulty_score,
+            computed_difficulty=computed_difficulty,
+            confidence_interval=confidence_interval,
+            last_computed=datetime.now()
+        )
+    
+    def _metrics_from_rows(self, rows, total_active_students: int) -> List[DifficultyMetrics]:
+        """Vectorized _metrics_from_row for a whole batch of aggregated rows"""
+        if not rows:
+            return []
+        
+        question_ids = [row.question_id for row in rows]
+        attempts = np.array([row.total_attempts for row in rows], dtype=float)
+        correct = np.array([row.total_correct for row in rows], dtype=float)
+        unique_users = np.array([row.unique_users for row in rows], dtype=float)
+        avg_response_time = np.array(
+            [(row.avg_response_time_ms or 30000) / 1000 for row in rows], dtype=float
+        )
+        expected_time = np.array(
+            [self.EXPECTED_RESPONSE_TIMES.get(self._extract_knowledge_type(qid), 30) for qid in question_ids],
+            dtype=float
+        )
+        
+        success_rate = correct / attempts
+        reach_rate = unique_users / max(total_active_students, 1)
+        
+        # Same weights as _calculate_composite_difficulty
+        reach_penalty = np.maximum(0.0, (0.5 - reach_rate) * 2)
+        time_factor = np.minimum(1.0, avg_response_time / expected_time)
+        difficulty_score = np.clip(
+            (1.0 - success_rate) * 0.6 + reach_penalty * 0.25 + (time_factor - 0.5) * 0.15,
+            0.0, 1.0
+        )
+        
+        # Same thresholds as _score_to_difficulty
+        computed_difficulty = np.where(
+            difficulty_score <= 0.3, 'beginner',
+            np.where(difficulty_score <= 0.7, 'intermediate', 'advanced')
+        )
+        
+        # 95% Wilson score interval, as in _calculate_confidence_interval
+        denominator = 1 + _Z95_SQ / attempts
+        center = (success_rate + _Z95_SQ / (2 * attempts)) / denominator
+        margin = _Z95 * np.sqrt((success_rate * (1 - success_rate) + _Z95_SQ / (4 * attempts)) / attempts) / denominator
+        confidence_lower = np.maximum(0.0, center - margin)
+        confidence_upper = np.minimum(1.0, center + margin)
+        
+        now = datetime.now()
+        return [
+            DifficultyMetrics(
+                question_id=question_ids[i],
+                global_success_rate=float(success_rate[i]),
+                total_attempts=int(attempts[i]),
+                average_response_time=float(avg_response_time[i]),
+                reach_rate=float(reach_rate[i]),
+                difficulty_score=float(difficulty_score[i]),
+                computed_difficulty=str(computed_difficulty[i]),
+                confidence_interval=(float(confidence_lower[i]), float(confidence_upper[i])),
+                last_computed=now
+            )
+            for i in range(len(question_ids))
+        ]
+    
     def _calculate_composite_difficulty(
         self, 
         success_rate: float, 
@@ -229,29 +384,27 @@ class DifficultyCalculator:
             return (0.0, 0.0)
         
         p = successes / total
-        z = 1.96 if confidence == 0.95 else 1.645  # Z-score for 95% or 90% confidence
+        # Z-score for 95% or 90% confidence
+        z, z_sq = (_Z95, _Z95_SQ) if confidence == 0.95 else (_Z90, _Z90_SQ)
         
-        denominator = 1 + (z**2) / total
-        center = (p + (z**2) / (2 * total)) / denominator
-        margin = z * math.sqrt((p * (1 - p) + (z**2) / (4 * total)) / total) / denominator
+        denominator = 1 + z_sq / total
+        center = (p + z_sq / (2 * total)) / denominator
+        margin = z * math.sqrt((p * (1 - p) + z_sq / (4 * total)) / total) / denominator
         
         return (max(0, center - margin), min(1, center + margin))
     
     def _extract_knowledge_type(self, question_id: str) -> str:
         """Extract knowledge type from question ID or metadata"""
-        # Simple heuristic based on question ID patterns
-        if 'dosage' in question_id.lower() or 'dose' in question_id.lower():
-            return 'dosage'
-        elif 'side_effect' in question_id.lower() or 'adverse' in question_id.lower():
-            return 'side_effect'
-        elif 'pharmacodynamics' in question_id.lower() or 'mechanism' in question_id.lower():
-            return 'pharmacodynamics'
-        elif 'pharmacokinetics' in question_id.lower() or 'absorption' in question_id.lower():
-            return 'pharmacokinetics'
-        elif 'term' in question_id.lower():
-            return 'terminology'
-        else:
-            return 'general'
+        # Simple heuristic based on question ID patterns: one regex scan, then
+        # the highest-priority category among the keywords found
+        found = {
+            _KNOWLEDGE_TYPE_KEYWORDS[keyword.lower()]
+            for keyword in _KNOWLEDGE_TYPE_PATTERN.findall(question_id)
+        }
+        for knowledge_type in _KNOWLEDGE_TYPE_PRIORITY:
+            if knowledge_type in found:
+                return knowledge_type
+        return 'general'
     
     async def _get_active_students_count(self, db, days_back: int) -> int:
         """Get count of active students in the given time period"""
@@ -262,55 +415,43 @@ class DifficultyCalculator:
             WHERE created_at >= :cutoff_date
         """)
         
-        result = db.execute(query, {"cutoff_date": cutoff_date}).fetchone()
+        result = (await db.execute(query, {"cutoff_date": cutoff_date})).first()
         return result.active_students if result else 1
     
-    async def _save_difficulty_metrics(self, db, metrics: DifficultyMetrics):
-        """Save calculated difficulty metrics to database"""
+    async def _save_difficulty_metrics(self, db, metrics_list: List[DifficultyMetrics]):
+        """Upsert calculated difficulty metrics in one statement and commit once"""
+        if not metrics_list:
+            return
         try:
-            # Insert or update question metrics
-            query = text("""
-                INSERT INTO question_metrics (
-                    question_id, global_success_rate, total_attempts, 
-                    average_response_time, reach_rate, difficulty_score,
-                    computed_difficulty, confidence_lower, confidence_upper,
-                    last_computed, created_at, updated_at
-                ) VALUES (
-                    :question_id, :global_success_rate, :total_attempts,
-                    :average_response_time, :reach_rate, :difficulty_score,
-                    :computed_difficulty, :confidence_lower, :confidence_upper,
-                    :last_computed, NOW(), NOW()
-                ) ON CONFLICT (question_id) DO UPDATE SET
-                    global_success_rate = EXCLUDED.global_success_rate,
-                    total_attempts = EXCLUDED.total_attempts,
-                    average_response_time = EXCLUDED.average_response_time,
-                    reach_rate = EXCLUDED.reach_rate,
-                    difficulty_score = EXCLUDED.difficulty_score,
-                    computed_difficulty = EXCLUDED.computed_difficulty,
-                    confidence_lower = EXCLUDED.confidence_lower,
-                    confidence_upper = EXCLUDED.confidence_upper,
-                    last_computed = EXCLUDED.last_computed,
-                    updated_at = NOW()
-            """)
-            
-            db.execute(query, {
-                "question_id": metrics.question_id,
-                "global_success_rate": metrics.global_success_rate,
-                "total_attempts": metrics.total_attempts,
-                "average_response_time": metrics.average_response_time,
-                "reach_rate": metrics.reach_rate,
-                "difficulty_score": metrics.difficulty_score,
-                "computed_difficulty": metrics.computed_difficulty,
-                "confidence_lower": metrics.confidence_interval[0],
-                "confidence_upper": metrics.confidence_interval[1],
-                "last_computed": metrics.last_computed
-            })
-            
-            db.commit()
+            rows = [
+                {
+                    "question_id": m.question_id,
+                    "global_success_rate": m.global_success_rate,
+                    "total_attempts": m.total_attempts,
+                    "average_response_time": m.average_response_time,
+                    "reach_rate": m.reach_rate,
+                    "difficulty_score": m.difficulty_score,
+                    "computed_difficulty": m.computed_difficulty,
+                    "confidence_lower": m.confidence_interval[0],
+                    "confidence_upper": m.confidence_interval[1],
+                    "last_computed": m.last_computed,
+                }
+                for m in metrics_list
+            ]
+            stmt = pg_insert(QuestionMetrics).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["question_id"],
+                set_={
+                    **{col: stmt.excluded[col] for col in rows[0] if col != "question_id"},
+                    "updated_at": func.now(),
+                },
+            )
+            await db.execute(stmt)
+            await db.commit()
             
         except Exception as e:
             logger.error(f"Error saving difficulty metrics: {e}")
-            db.rollback()
+            await db.rollback()
 
 # Global instance
 difficulty_calculator = DifficultyCalculator()
\ No newline at end of file
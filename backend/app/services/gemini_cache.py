@@ -0,0 +1,45 @@
+"""
+Content-addressable disk cache for Gemini question analyses
+"""
+import os
+import tempfile
+import time
+from typing import Any, Dict, Optional
+
+import orjson
+
+GEMINI_CACHE_DIR = os.getenv("GEMINI_CACHE_DIR", os.path.join("cache", "gemini"))
+# Entries older than this are treated as misses (the taxonomy or model may have moved on)
+GEMINI_CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+
+def _path(key: str) -> str:
+    return os.path.join(GEMINI_CACHE_DIR, f"{key}.json")
+
+
+def get(key: str) -> Optional[Dict[str, Any]]:
+    """Return the cached analysis for key, or None on a miss or an expired entry"""
+    try:
+        with open(_path(key), "rb") as f:
+            if time.time() - os.fstat(f.fileno()).st_mtime > GEMINI_CACHE_TTL_SECONDS:
+                return None
+            return orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return None
+
+
+def put(key: str, value: Dict[str, Any]) -> None:
+    """Store an analysis atomically (temp file + os.replace) so readers never see a partial file"""
+    try:
+        os.makedirs(GEMINI_CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=GEMINI_CACHE_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(orjson.dumps(value))
+            os.replace(tmp_path, _path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        # Cache is best-effort; a read-only or full disk must not fail the analysis
+        pass
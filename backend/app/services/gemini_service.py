@@ -2,164 +2,533 @@
 Gemini AI Service for intelligent question analysis
 """
 import os
-import json
 import re
+import asyncio
+import orjson
+import hashlib
+import logging
 import httpx
-from typing import Optional, List, Dict, Any
+import ijson
+import json_repair
+from functools import lru_cache
+from cachetools import TTLCache
+from typing import Optional, List, Dict, Any, Literal, Tuple
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import gemini_cache, semantic_cache
+from ..models import Course, Topic, Subtopic, KnowledgeType
+
+logger = logging.getLogger(__name__)
 
 # Gemini API configuration
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
-# Use gemma-3-27b-it - free tier has 14,400 RPD limit (much higher than gemini-2.5-flash's 20 RPD)
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemma-3-27b-it:generateContent"
+# gemini-2.5-flash-lite: fast, cheap and supports JSON-schema output, enough for categorization.
+# Override with GEMINI_MODEL (e.g. gemma-3-27b-it for its higher free-tier RPD limit)
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-lite")
+GEMINI_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent"
+GEMINI_STREAM_URL = GEMINI_API_URL.replace(":generateContent", ":streamGenerateContent")
+# Gemma models reject responseMimeType/responseSchema; Gemini models get schema-constrained JSON
+GEMINI_JSON_MODE = not GEMINI_MODEL.startswith("gemma")
+# Gemini context caching: the catalog block is stored once server-side and referenced by name
+GEMINI_CONTEXT_CACHE = GEMINI_JSON_MODE and os.getenv("GEMINI_CONTEXT_CACHE", "1") == "1"
+GEMINI_CACHED_CONTENTS_URL = "https://generativelanguage.googleapis.com/v1beta/cachedContents"
+CONTEXT_CACHE_TTL_SECONDS = 3600
+# Bump whenever the prompt or the result shape changes so cached analyses are not reused
+PROMPT_VERSION = 2
+
+# analyze_question calls in progress, by cache key
+_inflight: Dict[str, "asyncio.Future[Dict[str, Any]]"] = {}
+
+# sha256(catalog block) -> cachedContents name, or None when the API declined it
+# (e.g. below the minimum cacheable size); expires before the server-side TTL
+_context_caches: TTLCache = TTLCache(maxsize=64, ttl=CONTEXT_CACHE_TTL_SECONDS - 300)
+_context_cache_lock = asyncio.Lock()
+
+# Shared client: keeps the TLS connection to the Gemini API alive between calls
+_client: Optional[httpx.AsyncClient] = None
+
+# Streaming calls: httpx applies the read timeout to each socket read, so a
+# stalled stream fails after 10 s without capping the total generation time
+STREAM_TIMEOUT = httpx.Timeout(connect=5.0, read=10.0, write=5.0, pool=5.0)
+
+
+def _get_client() -> httpx.AsyncClient:
+    """Lazily create the shared HTTP/2 client"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=True,
+            # Generous read timeout for long generations, but fail fast on connect
+            timeout=httpx.Timeout(60.0, connect=5.0),
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=50, keepalive_expiry=60.0),
+        )
+    return _client
+
+
+async def close_client() -> None:
+    """Close the shared client (called on app shutdown)"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+# Opening ```/```json fence and closing ``` fence, stripped in one pass
+_RE_FENCE = re.compile(r'^```(?:json)?\s*|\s*```\s*$')
 
 
 def extract_json_from_text(text: str) -> Optional[Dict]:
     """
     Try to extract JSON from text, handling various formats and incomplete JSON.
+    Truncated or slightly malformed output is repaired in a single pass by json_repair.
     """
-    text = text.strip()
-
     # Remove markdown code blocks
-    if text.startswith("```json"):
-        text = text[7:]
-    if text.startswith("```"):
-        text = text[3:]
-    if text.endswith("```"):
-        text = text[:-3]
-    text = text.strip()
-
-    # Try direct parse first
+    text = _RE_FENCE.sub("", text.strip())
+
+    # Fenced but otherwise valid JSON: no scan, no repair
+    if text[:1] == "{":
+        try:
+            result = orjson.loads(text)
+            return result if isinstance(result, dict) and result else None
+        except orjson.JSONDecodeError:
+            start = 0
+    else:
+        # Skip any prose before the JSON object
+        start = text.find("{")
+        if start == -1:
+            return None
+
+    result = json_repair.loads(text[start:])
+    return result if isinstance(result, dict) and result else None
+
+
+def _parse_analysis(text: str) -> Optional[Dict]:
+    """
+    Parse a model answer. Schema-constrained output is plain JSON; the repair path
+    only runs for Gemma models (no JSON mode) or output cut off at maxOutputTokens.
+    """
+    # Slicing only happens when DEBUG logging is enabled
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Gemini raw response: %s", text[:500])
     try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        pass
+        result = orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return extract_json_from_text(text)
+    return result if isinstance(result, dict) and result else None
 
-    # Try to find JSON object in text
-    json_match = re.search(r'\{.*', text, re.DOTALL)
-    if not json_match:
-        return None
 
-    json_str = json_match.group()
+def _taxonomy_signature(
+    existing_topics: List[Dict[str, Any]],
+    existing_subtopics: List[Dict[str, Any]],
+    existing_knowledge_types: List[Dict[str, Any]],
+) -> Dict[str, List[Any]]:
+    """Taxonomy lists reduced to their id sets"""
+    return {
+        "t_sig": sorted(t["id"] for t in existing_topics),
+        "s_sig": sorted(s["id"] for s in existing_subtopics),
+        "k_sig": sorted(k["id"] for k in existing_knowledge_types),
+    }
+
 
-    # Try parsing as-is
-    try:
-        return json.loads(json_str)
-    except json.JSONDecodeError:
-        pass
-
-    # Aggressive fix for truncated JSON
-    # Step 1: Find and remove any incomplete string at the end
-    # Pattern: we're looking for unclosed strings
-
-    # Remove everything after the last complete value
-    # Find last occurrence of: "value" or number or true/false/null followed by comma or brace
-
-    # First, try to find the last complete key-value pair
-    # Look for patterns like: "key": "value", or "key": number, or "key": null,
-
-    fixed = json_str
-
-    # Check if we have an unclosed string at the end
-    # Count quotes - if odd, we have an unclosed string
-    quote_count = fixed.count('"')
-    if quote_count % 2 == 1:
-        # Find the last quote and remove from there
-        last_quote = fixed.rfind('"')
-        # Go back to find the start of this incomplete key or value
-        # Look for the comma or brace before this
-        search_area = fixed[:last_quote]
-
-        # Find last complete structure (ends with ", or }, or ])
-        last_complete = -1
-        for pattern in ['},', '},\n', '",', '",\n', '],', '],\n', 'null,', 'true,', 'false,']:
-            idx = search_area.rfind(pattern)
-            if idx > last_complete:
-                last_complete = idx + len(pattern) - 1  # Keep the comma
-
-        if last_complete > 0:
-            fixed = fixed[:last_complete]
-
-    # Remove trailing comma if any
-    fixed = fixed.rstrip().rstrip(',').rstrip()
-
-    # Count braces and add missing ones
-    open_braces = fixed.count('{')
-    close_braces = fixed.count('}')
-    open_brackets = fixed.count('[')
-    close_brackets = fixed.count(']')
-
-    # Add missing brackets first, then braces
-    fixed += ']' * (open_brackets - close_brackets)
-    fixed += '}' * (open_braces - close_braces)
+def _analysis_cache_key(
+    question_text: str,
+    course_name: str,
+    existing_topics: List[Dict[str, Any]],
+    existing_subtopics: List[Dict[str, Any]],
+    existing_knowledge_types: List[Dict[str, Any]],
+) -> str:
+    """sha256 of the normalized analysis inputs (taxonomy lists reduced to their id sets)"""
+    payload = orjson.dumps({
+        "v": PROMPT_VERSION,
+        "q": question_text.strip(),
+        "c": course_name,
+        **_taxonomy_signature(existing_topics, existing_subtopics, existing_knowledge_types),
+    }, option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(payload).hexdigest()
+
+
+def _semantic_namespace(
+    course_name: str,
+    existing_topics: List[Dict[str, Any]],
+    existing_subtopics: List[Dict[str, Any]],
+    existing_knowledge_types: List[Dict[str, Any]],
+) -> str:
+    """
+    Semantic cache namespace: course plus taxonomy hash, so a changed taxonomy
+    never serves back deleted or renamed topic/subtopic ids
+    """
+    payload = orjson.dumps({
+        "v": PROMPT_VERSION,
+        **_taxonomy_signature(existing_topics, existing_subtopics, existing_knowledge_types),
+    }, option=orjson.OPT_SORT_KEYS)
+    return f"{course_name}:{hashlib.sha256(payload).hexdigest()}"
+
+
+# Result fields that hold for any paraphrase of a question; the content fields
+# (text, options, answer, explanation) belong to one specific question
+_CLASSIFICATION_FIELDS = ("topic", "subtopic", "knowledgeType", "questionType")
+
+
+# Questions sent per batched prompt; answer quality degrades past this
+GEMINI_BATCH_SIZE = 15
+# Concurrent Gemini calls issued by analyze_questions_parallel / analyze_questions_batch
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+
+_ANALYSIS_JSON_SHAPE = """{
+  "topic": {"id": null, "name": "topic_name", "displayName": "Konu Adi"},
+  "subtopic": {"id": null, "name": "subtopic_name", "displayName": "Alt Konu Adi"},
+  "knowledgeTypeId": 1,
+  "questionType": "multiple_choice",
+  "questionText": "Question without options",
+  "correctAnswer": "The correct option text",
+  "options": ["Option A text", "Option B text", "Option C text", "Option D text"],
+  "explanation": "Brief explanation"
+}"""
+
+_ANALYSIS_RULES = """RULES:
+- Use existing topic/subtopic ID if it matches, otherwise id=null for new
+- questionText: Only the question, no A/B/C/D options
+- correctAnswer: The FULL TEXT of correct option (not just A/B/C/D letter)
+- options: Array of 4 option texts without A/B/C/D prefixes
+- For true_false: correctAnswer="true" or "false", options=null
+- For fill_in_blank: use ___ in questionText, options=null"""
+
+
+# responseSchema (OpenAPI subset) matching _ANALYSIS_JSON_SHAPE
+_TAXONOMY_REF_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "id": {"type": "INTEGER", "nullable": True},
+        "name": {"type": "STRING"},
+        "displayName": {"type": "STRING"},
+    },
+    "required": ["id", "name", "displayName"],
+}
+ANALYSIS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "topic": _TAXONOMY_REF_SCHEMA,
+        "subtopic": _TAXONOMY_REF_SCHEMA,
+        "knowledgeTypeId": {"type": "INTEGER"},
+        "questionType": {"type": "STRING", "enum": ["multiple_choice", "true_false", "fill_in_blank"]},
+        "questionText": {"type": "STRING"},
+        "correctAnswer": {"type": "STRING"},
+        "options": {"type": "ARRAY", "items": {"type": "STRING"}, "nullable": True},
+        "explanation": {"type": "STRING"},
+    },
+    "required": [
+        "topic", "subtopic", "knowledgeTypeId", "questionType",
+        "questionText", "correctAnswer", "options", "explanation",
+    ],
+}
+BATCH_ANALYSIS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {"results": {"type": "ARRAY", "items": ANALYSIS_SCHEMA}},
+    "required": ["results"],
+}
+
+
+# Typed view of one model answer; pydantic-core validates the whole dict in one
+# compiled pass. Defaults cover fields the model omitted (Gemma, truncation).
+class TaxonomyRef(BaseModel):
+    id: Optional[int] = None
+    name: Optional[str] = None
+    displayName: Optional[str] = None
+
+
+class GeminiAnalysis(BaseModel):
+    topic: TaxonomyRef = TaxonomyRef()
+    subtopic: TaxonomyRef = TaxonomyRef()
+    knowledgeTypeId: Optional[int] = 9  # "general"
+    questionType: Literal["multiple_choice", "true_false", "fill_in_blank"] = "multiple_choice"
+    questionText: Optional[str] = ""
+    correctAnswer: Optional[str] = ""
+    options: Optional[List[str]] = None
+    explanation: Optional[str] = None
+
+
+@lru_cache(maxsize=32)
+def _format_taxonomy(topics_key: tuple, subtopics_key: tuple, knowledge_types_key: tuple) -> str:
+    """
+    Prompt block for a taxonomy snapshot; identical across questions of a course.
+    Compact tab-separated rows - display names are left out, the model derives them from name.
+    """
+    topics_list = "\n".join([f"{t_id}\t{name}" for t_id, name in topics_key])
+    subtopics_list = "\n".join([f"{s_id}\t{topic_id}\t{name}" for s_id, topic_id, name in subtopics_key])
+    # Description only where one exists - it helps knowledge type selection
+    knowledge_types_list = "\n".join([
+        f"{k_id}\t{name}\t{description}" if description else f"{k_id}\t{name}"
+        for k_id, name, description in knowledge_types_key
+    ])
+
+    return "\n".join([
+        "EXISTING TOPICS (id name):",
+        topics_list or "NONE",
+        "EXISTING SUBTOPICS (id topic_id name):",
+        subtopics_list or "NONE",
+        "KNOWLEDGE TYPES (id name description):",
+        knowledge_types_list,
+    ])
+
+
+def _taxonomy_context(
+    existing_topics: List[Dict[str, Any]],
+    existing_subtopics: List[Dict[str, Any]],
+    existing_knowledge_types: List[Dict[str, Any]],
+) -> str:
+    """Taxonomy block shared by the single and batched prompts"""
+    return _format_taxonomy(
+        tuple((t['id'], t['name']) for t in existing_topics),
+        tuple((s['id'], s['topicId'], s['name']) for s in existing_subtopics),
+        tuple((k['id'], k['name'], k.get('description', '')) for k in existing_knowledge_types),
+    )
+
+
+async def _catalog_prompt(taxonomy_context: str) -> Tuple[str, Optional[str]]:
+    """
+    (taxonomy block for the prompt, cachedContents name). When the catalog is held in a
+    Gemini context cache the prompt only carries the question-specific part.
+    """
+    cached_content = await _cached_catalog(taxonomy_context)
+    if cached_content:
+        return "(Use the EXISTING TOPICS / SUBTOPICS / KNOWLEDGE TYPES given above.)", cached_content
+    return taxonomy_context, None
 
+
+async def _cached_catalog(taxonomy_context: str) -> Optional[str]:
+    """Name of a cachedContents entry holding the catalog block, created on first use"""
+    if not GEMINI_CONTEXT_CACHE:
+        return None
+    key = hashlib.sha256(taxonomy_context.encode()).hexdigest()
+    if key in _context_caches:
+        return _context_caches[key]
+
+    async with _context_cache_lock:
+        if key in _context_caches:
+            return _context_caches[key]
+        try:
+            response = await _get_client().post(
+                f"{GEMINI_CACHED_CONTENTS_URL}?key={GEMINI_API_KEY}",
+                content=orjson.dumps({
+                    "model": f"models/{GEMINI_MODEL}",
+                    "contents": [{"role": "user", "parts": [{"text": taxonomy_context}]}],
+                    "ttl": f"{CONTEXT_CACHE_TTL_SECONDS}s",
+                }),
+                headers={"Content-Type": "application/json"}
+            )
+            if response.status_code == 200:
+                name = orjson.loads(response.content).get("name")
+            elif response.status_code == 400:
+                # Catalog too small to cache (or model unsupported) - send it inline
+                name = None
+            else:
+                logger.warning(f"Gemini context cache creation failed: {response.status_code}")
+                return None
+        except Exception as e:
+            # Caching is an optimization only; fall back to the inline catalog
+            logger.warning(f"Gemini context cache creation failed: {e}")
+            return None
+
+        _context_caches[key] = name
+        return name
+
+
+def _request_body(
+    prompt: str,
+    max_output_tokens: int,
+    schema: Optional[Dict[str, Any]] = None,
+    cached_content: Optional[str] = None,
+) -> bytes:
+    """Serialized generateContent request"""
+    generation_config = {
+        "temperature": 0.1,
+        "maxOutputTokens": max_output_tokens
+    }
+    if schema is not None and GEMINI_JSON_MODE:
+        generation_config["responseMimeType"] = "application/json"
+        generation_config["responseSchema"] = schema
+    body = {
+        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+        "generationConfig": generation_config
+    }
+    if cached_content:
+        body["cachedContent"] = cached_content
+    return orjson.dumps(body)
+
+
+def _extract_text(response: Dict[str, Any]) -> str:
+    """Generated text of the first candidate, or "" if the response has none"""
     try:
-        return json.loads(fixed)
-    except json.JSONDecodeError:
-        pass
-
-    # Last resort: try to extract just the critical fields with regex
-    result = {}
-
-    # Extract topic
-    topic_match = re.search(r'"topic"\s*:\s*\{[^}]*"id"\s*:\s*(\d+|null)[^}]*"name"\s*:\s*"([^"]*)"[^}]*"displayName"\s*:\s*"([^"]*)"', json_str)
-    if topic_match:
-        result["topic"] = {
-            "id": int(topic_match.group(1)) if topic_match.group(1) != "null" else None,
-            "name": topic_match.group(2),
-            "displayName": topic_match.group(3)
-        }
+        return response["candidates"][0]["content"]["parts"][0]["text"]
+    except (KeyError, IndexError, TypeError):
+        return ""
 
-    # Extract subtopic - might be incomplete
-    subtopic_match = re.search(r'"subtopic"\s*:\s*\{[^}]*"id"\s*:\s*(\d+|null)', json_str)
-    subtopic_name = re.search(r'"subtopic"\s*:\s*\{[^}]*"name"\s*:\s*"([^"]*)"', json_str)
-    subtopic_display = re.search(r'"subtopic"\s*:\s*\{[^}]*"displayName"\s*:\s*"([^"]*)"', json_str)
 
-    if subtopic_match:
-        result["subtopic"] = {
-            "id": int(subtopic_match.group(1)) if subtopic_match.group(1) != "null" else None,
-            "name": subtopic_name.group(1) if subtopic_name else "unknown",
-            "displayName": subtopic_display.group(1) if subtopic_display else "Bilinmeyen"
-        }
+async def _generate(
+    prompt: str,
+    max_output_tokens: int = 4096,
+    schema: Optional[Dict[str, Any]] = None,
+    cached_content: Optional[str] = None,
+) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """Call Gemini; returns (generated_text, None) or (None, error result)"""
+    client = _get_client()
+    response = await client.post(
+        f"{GEMINI_API_URL}?key={GEMINI_API_KEY}",
+        content=_request_body(prompt, max_output_tokens, schema, cached_content),
+        headers={"Content-Type": "application/json"}
+    )
+
+    if response.status_code != 200:
+        return None, {"success": False, "error": f"Gemini API error: {response.status_code} - {response.text}"}
+
+    result = orjson.loads(response.content)
 
-    # Extract other fields
-    kt_match = re.search(r'"knowledgeTypeId"\s*:\s*(\d+)', json_str)
-    if kt_match:
-        result["knowledgeTypeId"] = int(kt_match.group(1))
+    generated_text = _extract_text(result)
 
-    qt_match = re.search(r'"questionType"\s*:\s*"([^"]*)"', json_str)
-    if qt_match:
-        result["questionType"] = qt_match.group(1)
+    if not generated_text:
+        return None, {"success": False, "error": f"Empty response from Gemini. Full response: {orjson.dumps(result)[:500].decode(errors='ignore')}"}
 
-    qtext_match = re.search(r'"questionText"\s*:\s*"([^"]*)"', json_str)
-    if qtext_match:
-        result["questionText"] = qtext_match.group(1)
+    return generated_text, None
 
-    answer_match = re.search(r'"correctAnswer"\s*:\s*"([^"]*)"', json_str)
-    if answer_match:
-        result["correctAnswer"] = answer_match.group(1)
 
-    # Extract options array - handle multiline and escaped quotes
-    options_match = re.search(r'"options"\s*:\s*\[(.*?)\]', json_str, re.DOTALL)
-    if options_match:
-        options_str = options_match.group(1)
-        # Handle both simple and escaped quotes
-        options = re.findall(r'"((?:[^"\\]|\\.)*)"', options_str)
-        if options:
-            result["options"] = options
+async def _generate_stream(
+    prompt: str,
+    max_output_tokens: int = 4096,
+    schema: Optional[Dict[str, Any]] = None,
+    cached_content: Optional[str] = None,
+) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """
+    Like _generate, but reads the SSE stream and stops as soon as the top-level
+    JSON object is complete instead of waiting for the end of the generation.
+    Falls back to _generate if the streaming endpoint is unavailable.
+    """
+    client = _get_client()
+
+    chunks: List[str] = []
+    parsed = ijson.sendable_list()
+    parser = ijson.items_coro(parsed, "")
+    fed = 0  # characters of the joined text already sent to the parser
+    parsing = True
+
+    async with client.stream(
+        "POST",
+        f"{GEMINI_STREAM_URL}?alt=sse&key={GEMINI_API_KEY}",
+        content=_request_body(prompt, max_output_tokens, schema, cached_content),
+        headers={"Content-Type": "application/json"},
+        timeout=STREAM_TIMEOUT,
+    ) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return await _generate(prompt, max_output_tokens, schema, cached_content)
+
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            chunk = _extract_text(orjson.loads(line[5:]))
+            if not chunk:
+                continue
+            chunks.append(chunk)
+
+            if not parsing:
+                continue
+            text = "".join(chunks)
+            if fed == 0:
+                # Skip the code fence / prose before the object
+                start = text.find("{")
+                if start == -1:
+                    continue
+                fed = start
+            try:
+                parser.send(text[fed:].encode())
+            except ijson.JSONError:
+                # Malformed output: keep reading, extract_json_from_text repairs it
+                parsing = False
+                continue
+            fed = len(text)
+            if parsed:
+                # Object closed - the rest of the generation is not needed
+                break
+
+    generated_text = "".join(chunks)
+    if not generated_text:
+        return None, {"success": False, "error": "Empty response from Gemini"}
+    return generated_text, None
+
+
+def _build_analysis_result(analysis: Dict[str, Any], knowledge_types_by_id: Dict[Any, Dict[str, Any]]) -> Dict[str, Any]:
+    """Normalize one parsed model answer into the analyze_question result shape"""
+    try:
+        parsed = GeminiAnalysis.model_validate(analysis)
+    except ValidationError as e:
+        return {"success": False, "error": f"AI yanıtı beklenen formatta değil: {e.error_count()} hata"}
+
+    topic = parsed.topic
+    subtopic = parsed.subtopic
+
+    # Find knowledge type info
+    kt_info = knowledge_types_by_id.get(parsed.knowledgeTypeId) or (
+        next(iter(knowledge_types_by_id.values())) if knowledge_types_by_id else {"id": 9, "name": "general", "displayName": "Genel"}
+    )
+
+    return {
+        "success": True,
+        "topic": {
+            "id": topic.id,
+            "name": topic.name or "unknown",
+            "displayName": topic.displayName or "Bilinmeyen Konu",
+            "isNew": topic.id is None
+        },
+        "subtopic": {
+            "id": subtopic.id,
+            "name": subtopic.name or "unknown",
+            "displayName": subtopic.displayName or "Bilinmeyen Alt Konu",
+            "isNew": subtopic.id is None
+        },
+        "knowledgeType": {
+            "id": kt_info["id"],
+            "name": kt_info["name"],
+            "displayName": kt_info["displayName"]
+        },
+        "questionType": parsed.questionType,
+        "questionText": parsed.questionText,
+        "correctAnswer": parsed.correctAnswer,
+        "options": parsed.options,
+        "explanation": parsed.explanation
+    }
+
+
+async def load_course_taxonomy(db: AsyncSession, course_id: int):
+    """
+    Course plus the topic/subtopic/knowledge-type lists the AI prompt is built from,
+    or None if the course doesn't exist
+    """
+    # Get course info
+    course_result = await db.execute(select(Course).where(Course.id == course_id))
+    course = course_result.scalar_one_or_none()
+    if not course:
+        return None
 
-    # If options is null explicitly
-    if '"options"' in json_str and '"options": null' in json_str.replace(" ", "").replace("\n", ""):
-        result["options"] = None
+    # Get existing topics for this course
+    topics_result = await db.execute(
+        select(Topic).where(Topic.course_id == course_id, Topic.is_active == True)
+    )
+    topics = [{"id": t.id, "name": t.name, "displayName": t.display_name} for t in topics_result.scalars().all()]
 
-    explanation_match = re.search(r'"explanation"\s*:\s*"([^"]*)"', json_str)
-    if explanation_match:
-        result["explanation"] = explanation_match.group(1)
+    # Get existing subtopics for this course
+    subtopics_result = await db.execute(
+        select(Subtopic)
+        .join(Topic)
+        .where(Topic.course_id == course_id, Subtopic.is_active == True)
+    )
+    subtopics = [{"id": s.id, "topicId": s.topic_id, "name": s.name, "displayName": s.display_name} for s in subtopics_result.scalars().all()]
 
-    # If we extracted at least topic, return the result
-    if "topic" in result:
-        return result
+    # Get all knowledge types
+    kt_result = await db.execute(select(KnowledgeType).where(KnowledgeType.is_active == True))
+    knowledge_types = [{"id": k.id, "name": k.name, "displayName": k.display_name, "description": k.description or ""} for k in kt_result.scalars().all()]
 
-    return None
+    return course, topics, subtopics, knowledge_types
 
 
 async def analyze_question(
@@ -184,131 +553,247 @@ async def analyze_question(
             "explanation": str or None,
             "error": str or None
         }
+
+    A semantic-cache hit (paraphrase of an earlier question) carries only the
+    classification: questionText is the given text, and correctAnswer, options
+    and explanation are None.
     """
     if not GEMINI_API_KEY:
         return {"success": False, "error": "Gemini API key not configured"}
 
-    # Build context for the AI
-    topics_list = "\n".join([f"- ID:{t['id']} | {t['name']} | {t['displayName']}" for t in existing_topics])
-    subtopics_list = "\n".join([f"- ID:{s['id']} | TopicID:{s['topicId']} | {s['name']} | {s['displayName']}" for s in existing_subtopics])
-    # Include description for better knowledge type selection
-    knowledge_types_list = "\n".join([f"- ID:{k['id']} | {k['name']} | {k['displayName']} | {k.get('description', '')}" for k in existing_knowledge_types])
+    # Identical question + taxonomy was analyzed before: skip the API call
+    cache_key = _analysis_cache_key(
+        question_text, course_name, existing_topics, existing_subtopics, existing_knowledge_types
+    )
+    cached = gemini_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Same analysis already running (double-click, retry): wait for its result
+    inflight = _inflight.get(cache_key)
+    if inflight is not None:
+        return await asyncio.shield(inflight)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[cache_key] = future
+    try:
+        result = await _analyze_uncached(
+            question_text, course_name, existing_topics, existing_subtopics, existing_knowledge_types, cache_key
+        )
+    except asyncio.CancelledError:
+        # Only this caller was cancelled: waiters get an error result, not a
+        # CancelledError that reads as their own cancellation
+        future.set_result({"success": False, "error": "Analysis was cancelled"})
+        raise
+    except Exception as e:
+        # Raised outside _analyze_uncached's own try (embedding, catalog cache)
+        result = {"success": False, "error": f"Unexpected error: {str(e)}"}
+    finally:
+        del _inflight[cache_key]
+    future.set_result(result)
+    return result
+
+
+async def _analyze_uncached(
+    question_text: str,
+    course_name: str,
+    existing_topics: List[Dict[str, Any]],
+    existing_subtopics: List[Dict[str, Any]],
+    existing_knowledge_types: List[Dict[str, Any]],
+    cache_key: str,
+) -> Dict[str, Any]:
+    """Semantic cache lookup, then the Gemini call; successful results are cached"""
+    # Paraphrase of an already analyzed question from the same course and taxonomy:
+    # reuse its classification only, never another question's content
+    namespace = _semantic_namespace(course_name, existing_topics, existing_subtopics, existing_knowledge_types)
+    embedding = await semantic_cache.embed(question_text)
+    classification = await semantic_cache.lookup(embedding, namespace)
+    if classification is not None:
+        return {
+            "success": True,
+            **classification,
+            "questionText": question_text.strip(),
+            "correctAnswer": None,
+            "options": None,
+            "explanation": None,
+        }
+
+    taxonomy_block, cached_content = await _catalog_prompt(
+        _taxonomy_context(existing_topics, existing_subtopics, existing_knowledge_types)
+    )
 
     # Build compact prompt - minimize tokens to prevent truncation
     prompt = f"""Analyze this {course_name} question. Return ONLY valid JSON.
 
-EXISTING TOPICS: {topics_list if topics_list else "NONE"}
-EXISTING SUBTOPICS: {subtopics_list if subtopics_list else "NONE"}
-KNOWLEDGE TYPES: {knowledge_types_list}
+{taxonomy_block}
 
 QUESTION TEXT:
 {question_text}
 
 Return this exact JSON structure (fill ALL fields):
-{{
-  "topic": {{"id": null, "name": "topic_name", "displayName": "Konu Adi"}},
-  "subtopic": {{"id": null, "name": "subtopic_name", "displayName": "Alt Konu Adi"}},
-  "knowledgeTypeId": 1,
-  "questionType": "multiple_choice",
-  "questionText": "Question without options",
-  "correctAnswer": "The correct option text",
-  "options": ["Option A text", "Option B text", "Option C text", "Option D text"],
-  "explanation": "Brief explanation"
-}}
+{_ANALYSIS_JSON_SHAPE}
 
-RULES:
-- Use existing topic/subtopic ID if it matches, otherwise id=null for new
-- questionText: Only the question, no A/B/C/D options
-- correctAnswer: The FULL TEXT of correct option (not just A/B/C/D letter)
-- options: Array of 4 option texts without A/B/C/D prefixes
-- For true_false: correctAnswer="true" or "false", options=null
-- For fill_in_blank: use ___ in questionText, options=null
+{_ANALYSIS_RULES}
 
 JSON:"""
 
     try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                f"{GEMINI_API_URL}?key={GEMINI_API_KEY}",
-                json={
-                    "contents": [{"parts": [{"text": prompt}]}],
-                    "generationConfig": {
-                        "temperature": 0.1,
-                        "maxOutputTokens": 4096
-                    }
-                },
-                headers={"Content-Type": "application/json"}
-            )
+        generated_text, error = await _generate_stream(
+            prompt, schema=ANALYSIS_SCHEMA, cached_content=cached_content
+        )
+        if error:
+            return error
 
-            if response.status_code != 200:
-                return {"success": False, "error": f"Gemini API error: {response.status_code} - {response.text}"}
+        analysis = _parse_analysis(generated_text)
 
-            result = response.json()
+        if not analysis:
+            return {
+                "success": False,
+                "error": "AI yanıtı işlenemedi. Lütfen tekrar deneyin.",
+                "rawResponse": generated_text[:800]  # Frontend'de F12 ile görebilirsin
+            }
+
+        analysis_result = _build_analysis_result(analysis, {k["id"]: k for k in existing_knowledge_types})
+
+        # Only successful analyses are cached
+        if analysis_result["success"]:
+            gemini_cache.put(cache_key, analysis_result)
+            await semantic_cache.store(
+                embedding, namespace, {field: analysis_result[field] for field in _CLASSIFICATION_FIELDS}
+            )
+        return analysis_result
 
-            # Extract the generated text
-            generated_text = result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
+    except orjson.JSONDecodeError as e:
+        return {"success": False, "error": f"JSON parse error: {str(e)}"}
+    except httpx.TimeoutException:
+        return {"success": False, "error": "Gemini API timeout"}
+    except Exception as e:
+        return {"success": False, "error": f"Unexpected error: {str(e)}"}
 
-            if not generated_text:
-                return {"success": False, "error": f"Empty response from Gemini. Full response: {json.dumps(result)[:500]}"}
 
-            # Use smart JSON extraction that handles incomplete responses
-            analysis = extract_json_from_text(generated_text)
+async def _analyze_chunk(
+    question_texts: List[str],
+    course_name: str,
+    taxonomy_context: str,
+    knowledge_types_by_id: Dict[Any, Dict[str, Any]],
+) -> List[Dict[str, Any]]:
+    """One Gemini call for up to GEMINI_BATCH_SIZE questions; results in input order"""
+    taxonomy_block, cached_content = await _catalog_prompt(taxonomy_context)
+    numbered = "\n".join(f"{i}. {text}" for i, text in enumerate(question_texts, 1))
+    prompt = f"""Analyze these {len(question_texts)} {course_name} questions. Return ONLY valid JSON.
 
-            if not analysis:
-                return {
-                    "success": False,
-                    "error": "AI yanıtı işlenemedi. Lütfen tekrar deneyin.",
-                    "rawResponse": generated_text[:800]  # Frontend'de F12 ile görebilirsin
-                }
+{taxonomy_block}
 
-            # Safely extract topic info
-            topic_data = analysis.get("topic", {})
-            if not isinstance(topic_data, dict):
-                topic_data = {}
+SORULAR:
+{numbered}
 
-            subtopic_data = analysis.get("subtopic", {})
-            if not isinstance(subtopic_data, dict):
-                subtopic_data = {}
+Return {{"results": [...]}} with exactly one object per question, in the same order, each with this exact structure (fill ALL fields):
+{_ANALYSIS_JSON_SHAPE}
 
-            # Determine if topic/subtopic are new
-            topic_id = topic_data.get("id")
-            subtopic_id = subtopic_data.get("id")
-            topic_is_new = topic_id is None
-            subtopic_is_new = subtopic_id is None
+{_ANALYSIS_RULES}
 
-            # Find knowledge type info
-            kt_id = analysis.get("knowledgeTypeId", 9)  # Default to "general"
-            kt_info = next((k for k in existing_knowledge_types if k["id"] == kt_id), existing_knowledge_types[0] if existing_knowledge_types else {"id": 9, "name": "general", "displayName": "Genel"})
+JSON:"""
 
-            return {
-                "success": True,
-                "topic": {
-                    "id": topic_id,
-                    "name": topic_data.get("name") or "unknown",
-                    "displayName": topic_data.get("displayName") or "Bilinmeyen Konu",
-                    "isNew": topic_is_new
-                },
-                "subtopic": {
-                    "id": subtopic_id,
-                    "name": subtopic_data.get("name") or "unknown",
-                    "displayName": subtopic_data.get("displayName") or "Bilinmeyen Alt Konu",
-                    "isNew": subtopic_is_new
-                },
-                "knowledgeType": {
-                    "id": kt_info["id"],
-                    "name": kt_info["name"],
-                    "displayName": kt_info["displayName"]
-                },
-                "questionType": analysis.get("questionType", "multiple_choice"),
-                "questionText": analysis.get("questionText", ""),
-                "correctAnswer": analysis.get("correctAnswer", ""),
-                "options": analysis.get("options"),
-                "explanation": analysis.get("explanation")
-            }
+    try:
+        generated_text, error = await _generate_stream(
+            prompt, max_output_tokens=8192, schema=BATCH_ANALYSIS_SCHEMA, cached_content=cached_content
+        )
+        if error:
+            return [error] * len(question_texts)
+
+        analysis = _parse_analysis(generated_text)
+        answers = analysis.get("results") if isinstance(analysis, dict) else None
+        if not isinstance(answers, list):
+            return [{
+                "success": False,
+                "error": "AI yanıtı işlenemedi. Lütfen tekrar deneyin.",
+                "rawResponse": generated_text[:800]
+            }] * len(question_texts)
+
+        results = []
+        for i in range(len(question_texts)):
+            answer = answers[i] if i < len(answers) else None
+            if isinstance(answer, dict):
+                results.append(_build_analysis_result(answer, knowledge_types_by_id))
+            else:
+                # Truncated output: the model stopped before this question
+                results.append({"success": False, "error": "AI yanıtı işlenemedi. Lütfen tekrar deneyin."})
+        return results
 
-    except json.JSONDecodeError as e:
-        return {"success": False, "error": f"JSON parse error: {str(e)}"}
     except httpx.TimeoutException:
-        return {"success": False, "error": "Gemini API timeout"}
+        return [{"success": False, "error": "Gemini API timeout"}] * len(question_texts)
     except Exception as e:
-        return {"success": False, "error": f"Unexpected error: {str(e)}"}
\ No newline at end of file
+        return [{"success": False, "error": f"Unexpected error: {str(e)}"}] * len(question_texts)
+
+
+async def analyze_questions_batch(
+    question_texts: List[str],
+    course_name: str,
+    existing_topics: List[Dict[str, Any]],
+    existing_subtopics: List[Dict[str, Any]],
+    existing_knowledge_types: List[Dict[str, Any]],
+) -> List[Dict[str, Any]]:
+    """
+    Analyze many questions, packing up to GEMINI_BATCH_SIZE per Gemini call so the
+    taxonomy context is sent once per chunk instead of once per question.
+
+    Returns one analyze_question-shaped result per input, in input order.
+    """
+    if not GEMINI_API_KEY:
+        return [{"success": False, "error": "Gemini API key not configured"}] * len(question_texts)
+
+    cache_keys = [
+        _analysis_cache_key(text, course_name, existing_topics, existing_subtopics, existing_knowledge_types)
+        for text in question_texts
+    ]
+    results: List[Optional[Dict[str, Any]]] = [gemini_cache.get(key) for key in cache_keys]
+
+    # Only questions missing from the disk cache go to the model
+    pending = [i for i, result in enumerate(results) if result is None]
+    taxonomy_context = _taxonomy_context(existing_topics, existing_subtopics, existing_knowledge_types)
+    knowledge_types_by_id = {k["id"]: k for k in existing_knowledge_types}
+    chunks = [pending[start:start + GEMINI_BATCH_SIZE] for start in range(0, len(pending), GEMINI_BATCH_SIZE)]
+
+    # Chunks are independent: send them concurrently over the shared client
+    semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+
+    async def _run_chunk(chunk: List[int]) -> List[Dict[str, Any]]:
+        async with semaphore:
+            return await _analyze_chunk(
+                [question_texts[i] for i in chunk], course_name, taxonomy_context, knowledge_types_by_id
+            )
+
+    for chunk, chunk_results in zip(chunks, await asyncio.gather(*[_run_chunk(c) for c in chunks])):
+        for i, result in zip(chunk, chunk_results):
+            results[i] = result
+            if result.get("success"):
+                gemini_cache.put(cache_keys[i], result)
+
+    return results
+
+
+async def analyze_questions_parallel(
+    question_texts: List[str],
+    course_name: str,
+    existing_topics: List[Dict[str, Any]],
+    existing_subtopics: List[Dict[str, Any]],
+    existing_knowledge_types: List[Dict[str, Any]],
+    concurrency: int = GEMINI_MAX_CONCURRENCY,
+) -> List[Dict[str, Any]]:
+    """
+    Run one analyze_question per question concurrently over the shared client,
+    at most `concurrency` in flight. Returns results in input order.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _one(question_text: str) -> Dict[str, Any]:
+        async with semaphore:
+            return await analyze_question(
+                question_text, course_name, existing_topics, existing_subtopics, existing_knowledge_types
+            )
+
+    results = await asyncio.gather(*[_one(text) for text in question_texts], return_exceptions=True)
+    return [
+        {"success": False, "error": f"Unexpected error: {str(r)}"} if isinstance(r, BaseException) else r
+        for r in results
+    ]
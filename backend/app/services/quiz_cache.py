@@ -0,0 +1,16 @@
+"""
+Short-lived in-process cache for read-mostly quiz aggregates (/subjects, /stats)
+"""
+from cachetools import TTLCache
+
+SUBJECTS_KEY = "quiz:subjects"
+STATS_KEY = "quiz:stats:v1"
+
+subjects_cache: TTLCache = TTLCache(maxsize=1, ttl=300)
+stats_cache: TTLCache = TTLCache(maxsize=1, ttl=60)
+
+
+def invalidate_quiz_cache() -> None:
+    """Drop cached aggregates after questions are created, updated or deleted"""
+    subjects_cache.clear()
+    stats_cache.clear()
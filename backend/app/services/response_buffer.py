@@ -0,0 +1,146 @@
+"""
+Buffered writer for student responses - batches inserts instead of committing every answer
+"""
+
+import asyncio
+import logging
+from typing import List, Optional
+
+from sqlalchemy import insert
+
+from ..db import AsyncSessionLocal
+from ..models.question_metrics import StudentResponse
+from .difficulty_calculator import difficulty_calculator
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+# Bound on queued rows: during a DB outage enqueue() refuses new rows instead
+# of growing memory without limit
+MAX_QUEUED_ROWS = 10000
+FLUSH_INTERVAL_SECONDS = 0.5
+RETRY_DELAY_SECONDS = 2.0
+# Write attempts per batch during shutdown, where we can't wait indefinitely
+SHUTDOWN_WRITE_ATTEMPTS = 3
+
+# Queued by stop(): the flusher writes what it holds and exits
+_STOP = object()
+
+_queue: "asyncio.Queue[dict]" = asyncio.Queue(maxsize=MAX_QUEUED_ROWS)
+_flusher_task: Optional[asyncio.Task] = None
+# Rows taken off the queue but not committed yet; kept until a write succeeds
+_pending: List[dict] = []
+_stop_requested = False
+
+
+def enqueue(row: dict) -> None:
+    """
+    Queue a student response row for the next batched insert.
+    Raises asyncio.QueueFull when MAX_QUEUED_ROWS rows are already waiting.
+    """
+    _queue.put_nowait(row)
+
+
+async def _write_batch(batch: List[dict]) -> None:
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(StudentResponse), batch)
+        await db.commit()
+    # Only now can a metrics read see the new rows
+    for question_id in {row["question_id"] for row in batch}:
+        difficulty_calculator.invalidate_question(question_id)
+
+
+async def _collect_batch() -> bool:
+    """
+    Wait for one row, then move more into _pending until the batch is full or
+    the interval ends. Returns True once stop() has been requested.
+    """
+    loop = asyncio.get_running_loop()
+    row = await _queue.get()
+    if row is _STOP:
+        return True
+    _pending.append(row)
+    deadline = loop.time() + FLUSH_INTERVAL_SECONDS
+    while len(_pending) < BATCH_SIZE:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        try:
+            row = await asyncio.wait_for(_queue.get(), remaining)
+        except asyncio.TimeoutError:
+            break
+        if row is _STOP:
+            return True
+        _pending.append(row)
+    return False
+
+
+async def _write_pending() -> None:
+    """
+    Write _pending in batches, keeping rows until their write succeeds. Failed
+    writes are retried indefinitely, or SHUTDOWN_WRITE_ATTEMPTS times once
+    stop() has been called.
+    """
+    attempt = 0
+    while _pending:
+        batch = _pending[:BATCH_SIZE]
+        attempt += 1
+        try:
+            await _write_batch(batch)
+        except Exception:
+            if _stop_requested and attempt >= SHUTDOWN_WRITE_ATTEMPTS:
+                raise
+            logger.exception(
+                "Failed to flush %d student responses (attempt %d), retrying in %.0fs",
+                len(batch), attempt, RETRY_DELAY_SECONDS,
+            )
+            await asyncio.sleep(RETRY_DELAY_SECONDS)
+        else:
+            del _pending[:len(batch)]
+            attempt = 0
+
+
+async def _flusher() -> None:
+    while not _stop_requested:
+        stopping = await _collect_batch()
+        if stopping:
+            return
+        await _write_pending()
+
+
+def start() -> None:
+    """Start the background flusher (called on app startup)"""
+    global _flusher_task
+    if _flusher_task is None or _flusher_task.done():
+        _flusher_task = asyncio.create_task(_flusher())
+
+
+async def stop() -> None:
+    """Stop the flusher and write everything still buffered (called on app shutdown)"""
+    global _flusher_task, _stop_requested
+    _stop_requested = True
+    try:
+        if _flusher_task is not None and not _flusher_task.done():
+            # Let a write in progress finish instead of cancelling it mid-commit.
+            # A full queue means the flusher isn't blocked on get(): it sees
+            # _stop_requested after its current batch.
+            try:
+                _queue.put_nowait(_STOP)
+            except asyncio.QueueFull:
+                pass
+            try:
+                await _flusher_task
+            except Exception:
+                logger.exception("Student response flusher failed during shutdown")
+
+        while not _queue.empty():
+            row = _queue.get_nowait()
+            if row is not _STOP:
+                _pending.append(row)
+        await _write_pending()
+    except Exception:
+        logger.exception("Dropping %d student responses that could not be written at shutdown", len(_pending))
+        _pending.clear()
+    finally:
+        _flusher_task = None
+        _stop_requested = False
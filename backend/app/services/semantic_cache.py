@@ -0,0 +1,157 @@
+"""
+Semantic cache for Gemini question analyses - paraphrased questions reuse an earlier
+classification (topic, subtopic, knowledge type, question type)
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+
+# Optional heavy dependencies - the cache is simply disabled without them
+try:
+    import faiss
+    from sentence_transformers import SentenceTransformer
+    SEMANTIC_CACHE_AVAILABLE = True
+except ImportError:
+    SEMANTIC_CACHE_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = os.getenv("SEMANTIC_CACHE_MODEL", "paraphrase-multilingual-MiniLM-L12-v2")
+SIMILARITY_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+# Neighbours checked per lookup when filtering by namespace
+SEARCH_K = 8
+
+# Index and entries are persisted so a restart doesn't re-embed the whole cache
+# (v2: entries hold classifications only, keyed by course + taxonomy namespace)
+SEMANTIC_CACHE_DIR = os.getenv("SEMANTIC_CACHE_DIR", os.path.join("cache", "semantic"))
+INDEX_PATH = os.path.join(SEMANTIC_CACHE_DIR, "questions.v2.faiss")
+ENTRIES_PATH = os.path.join(SEMANTIC_CACHE_DIR, "entries.v2.json")
+PERSIST_INTERVAL_SECONDS = 30.0
+
+_model = None
+_index = None
+# Parallel to the index rows: (namespace, classification)
+_entries: List[Tuple[str, Dict[str, Any]]] = []
+_lock = threading.Lock()
+_dirty = False
+_last_persist = 0.0
+
+
+def _load_index(dimension: int):
+    """Persisted index and entries, or a fresh empty index if missing or stale"""
+    global _entries
+    try:
+        # Read fully rather than IO_FLAG_MMAP: new entries are appended to this index
+        index = faiss.read_index(INDEX_PATH)
+        with open(ENTRIES_PATH, "rb") as f:
+            entries = [tuple(entry) for entry in orjson.loads(f.read())]
+        if index.d == dimension and index.ntotal == len(entries):
+            _entries = entries
+            return index
+    except Exception as e:
+        if os.path.exists(INDEX_PATH):
+            logger.warning("Semantic cache index could not be loaded, starting empty: %s", e)
+    return faiss.IndexFlatIP(dimension)
+
+
+def _persist() -> None:
+    """Write index and entries atomically (tmp + os.replace); caller holds _lock"""
+    global _dirty, _last_persist
+    try:
+        os.makedirs(SEMANTIC_CACHE_DIR, exist_ok=True)
+        faiss.write_index(_index, INDEX_PATH + ".tmp")
+        with open(ENTRIES_PATH + ".tmp", "wb") as f:
+            f.write(orjson.dumps(_entries))
+        os.replace(INDEX_PATH + ".tmp", INDEX_PATH)
+        os.replace(ENTRIES_PATH + ".tmp", ENTRIES_PATH)
+        _dirty = False
+    except Exception as e:
+        logger.warning("Semantic cache could not be persisted: %s", e)
+    _last_persist = time.monotonic()
+
+
+def _ensure_loaded() -> None:
+    """Load the embedding model and the persisted index on first use"""
+    global _model, _index
+    with _lock:
+        if _model is None:
+            _model = SentenceTransformer(EMBEDDING_MODEL)
+            _index = _load_index(_model.get_sentence_embedding_dimension())
+
+
+def _encode(question_text: str):
+    _ensure_loaded()
+    return _model.encode(question_text, normalize_embeddings=True).reshape(1, -1).astype("float32")
+
+
+def _search(embedding, namespace: str) -> Optional[Dict[str, Any]]:
+    with _lock:
+        if _index.ntotal == 0:
+            return None
+        # Entries are namespaced (course + taxonomy): the nearest neighbour may belong
+        # to another namespace, so look at the top few and take the best matching one
+        scores, ids = _index.search(embedding, min(SEARCH_K, _index.ntotal))
+        for score, row in zip(scores[0], ids[0]):
+            if row < 0 or score <= SIMILARITY_THRESHOLD:
+                break
+            stored_namespace, classification = _entries[row]
+            if stored_namespace == namespace:
+                return classification
+    return None
+
+
+def _add(embedding, namespace: str, classification: Dict[str, Any]) -> None:
+    global _dirty
+    with _lock:
+        _index.add(embedding)
+        _entries.append((namespace, classification))
+        _dirty = True
+        # Debounced: at most one write per interval, the rest is flushed on shutdown
+        if time.monotonic() - _last_persist >= PERSIST_INTERVAL_SECONDS:
+            _persist()
+
+
+def _flush() -> None:
+    with _lock:
+        if _dirty:
+            _persist()
+
+
+async def embed(question_text: str):
+    """Normalized embedding for a question (None when the cache is unavailable)"""
+    if not SEMANTIC_CACHE_AVAILABLE:
+        return None
+    try:
+        return await asyncio.to_thread(_encode, question_text)
+    except Exception as e:
+        # e.g. the model could not be downloaded - fall back to a normal API call
+        logger.warning("Semantic cache embedding failed: %s", e)
+        return None
+
+
+async def lookup(embedding, namespace: str) -> Optional[Dict[str, Any]]:
+    """Cached classification of a near-duplicate question in the same namespace, if any"""
+    if embedding is None:
+        return None
+    return await asyncio.to_thread(_search, embedding, namespace)
+
+
+async def store(embedding, namespace: str, classification: Dict[str, Any]) -> None:
+    """
+    Remember a successful classification for future near-duplicates. Only store
+    fields that hold for any paraphrase - never question text, options or answers.
+    """
+    if embedding is None:
+        return
+    await asyncio.to_thread(_add, embedding, namespace, classification)
+
+
+async def flush() -> None:
+    """Persist entries added since the last write (called on app shutdown)"""
+    if SEMANTIC_CACHE_AVAILABLE:
+        await asyncio.to_thread(_flush)
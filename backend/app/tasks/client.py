@@ -0,0 +1,14 @@
+"""
+Producer-side Celery app: lets the API enqueue and poll tasks by name without
+importing the worker modules (and their logging/engine setup)
+"""
+
+from celery import Celery
+
+BROKER_URL = "redis://localhost:6379/0"  # Will be overridden by env vars
+RESULT_BACKEND = "redis://localhost:6379/0"
+
+GEMINI_QUEUE = "gemini_queue"
+ANALYZE_QUESTIONS_TASK = "gemini.analyze_questions"
+
+celery_client = Celery("mabquiz_tasks", broker=BROKER_URL, backend=RESULT_BACKEND)
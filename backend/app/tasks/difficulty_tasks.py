@@ -4,14 +4,19 @@ Celery tasks for background difficulty calculation
 
 import asyncio
 import logging
+import threading
 from datetime import datetime, timedelta
 from typing import List, Optional
 from celery import Celery
+from celery.signals import worker_process_init
 from sqlalchemy import text
 
-from ..services.difficulty_calculator import difficulty_calculator
-from ..database import get_db
+from ..services.difficulty_calculator import (
+    difficulty_calculator, DIFFICULTY_VIEW, DIFFICULTY_VIEW_REFRESH_SECONDS,
+)
+from ..db import get_sync_db, sync_engine, async_engine
 from ..models.question_metrics import QuestionMetrics
+from .client import BROKER_URL, RESULT_BACKEND, GEMINI_QUEUE
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -20,8 +25,9 @@ logger = logging.getLogger(__name__)
 # Create Celery app
 celery_app = Celery(
     "mabquiz_tasks",
-    broker="redis://localhost:6379/0",  # Will be overridden by env vars
-    backend="redis://localhost:6379/0"
+    broker=BROKER_URL,
+    backend=RESULT_BACKEND,
+    include=["app.tasks.gemini_tasks"],
 )
 
 # Celery configuration
@@ -38,8 +44,43 @@ celery_app.conf.update(
     task_acks_late=True,
     worker_disable_rate_limits=False,
     task_default_queue='difficulty_calculation',
+    # Slow, rate-limited LLM calls get their own queue/workers so they never
+    # hold up the difficulty jobs: celery worker -Q gemini_queue
+    task_routes={'gemini.*': {'queue': GEMINI_QUEUE}},
 )
 
+# One event loop per worker process, running in a background thread. Tasks
+# submit coroutines to it, so the async engine's connection pool (bound to
+# the loop) survives between tasks instead of being rebuilt every time.
+_worker_loop: Optional[asyncio.AbstractEventLoop] = None
+_worker_loop_lock = threading.Lock()
+
+@worker_process_init.connect
+def _start_worker_loop(**kwargs):
+    global _worker_loop
+    with _worker_loop_lock:
+        if _worker_loop is None:
+            _worker_loop = asyncio.new_event_loop()
+            threading.Thread(target=_worker_loop.run_forever, name="difficulty-loop", daemon=True).start()
+
+@worker_process_init.connect
+def _reset_engine_pools(**kwargs):
+    """Give each forked worker its own pools; connections opened in the parent stay with it"""
+    sync_engine.dispose(close=False)
+    async_engine.sync_engine.dispose(close=False)
+
+def _run_async(coro):
+    """Run a coroutine on the worker loop and wait for its result"""
+    # Solo pool / eager mode never fire worker_process_init
+    _start_worker_loop()
+    future = asyncio.run_coroutine_threadsafe(coro, _worker_loop)
+    try:
+        return future.result(timeout=celery_app.conf.task_time_limit)
+    except BaseException:
+        # Soft time limit or timeout: don't leave the coroutine running
+        future.cancel()
+        raise
+
 @celery_app.task(bind=True, max_retries=3)
 def calculate_all_question_difficulties(self, days_back: int = 30, force_recalculate: bool = False):
     """
@@ -48,29 +89,22 @@ def calculate_all_question_difficulties(self, days_back: int = 30, force_recalcu
     try:
         logger.info(f"Starting daily difficulty calculation (days_back={days_back})")
         
-        # Run the async calculation in sync context
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        try:
-            results = loop.run_until_complete(
-                difficulty_calculator.batch_calculate_difficulties(
-                    question_ids=None,  # Calculate for all questions
-                    days_back=days_back
-                )
+        # Run the async calculation on the worker's long-lived loop
+        results = _run_async(
+            difficulty_calculator.batch_calculate_difficulties(
+                question_ids=None,  # Calculate for all questions
+                days_back=days_back
             )
-            
-            logger.info(f"Daily calculation completed: {len(results)} questions processed")
-            
-            return {
-                "success": True,
-                "processed_questions": len(results),
-                "completed_at": datetime.now().isoformat(),
-                "days_back": days_back
-            }
-            
-        finally:
-            loop.close()
+        )
+        
+        logger.info(f"Daily calculation completed: {len(results)} questions processed")
+        
+        return {
+            "success": True,
+            "processed_questions": len(results),
+            "completed_at": datetime.now().isoformat(),
+            "days_back": days_back
+        }
             
     except Exception as e:
         logger.error(f"Daily difficulty calculation failed: {e}")
@@ -93,33 +127,27 @@ def calculate_question_difficulties_batch(self, question_ids: List[str], days_ba
     try:
         logger.info(f"Processing difficulty batch: {len(question_ids)} questions")
         
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        try:
-            results = loop.run_until_complete(
-                difficulty_calculator.batch_calculate_difficulties(
-                    question_ids=question_ids,
-                    days_back=days_back
-                )
+        results = _run_async(
+            difficulty_calculator.batch_calculate_difficulties(
+                question_ids=question_ids,
+                days_back=days_back
             )
-            
-            successful_ids = list(results.keys())
-            failed_ids = [q_id for q_id in question_ids if q_id not in successful_ids]
-            
-            logger.info(f"Batch completed: {len(successful_ids)} succeeded, {len(failed_ids)} failed")
-            
-            return {
-                "success": True,
-                "processed_count": len(successful_ids),
-                "failed_count": len(failed_ids),
-                "successful_ids": successful_ids,
-                "failed_ids": failed_ids,
-                "completed_at": datetime.now().isoformat()
-            }
-            
-        finally:
-            loop.close()
+        )
+        
+        successful_ids = list(results.keys())
+        # results is a dict: O(1) membership, order of question_ids preserved
+        failed_ids = [q_id for q_id in question_ids if q_id not in results]
+        
+        logger.info(f"Batch completed: {len(successful_ids)} succeeded, {len(failed_ids)} failed")
+        
+        return {
+            "success": True,
+            "processed_count": len(successful_ids),
+            "failed_count": len(failed_ids),
+            "successful_ids": successful_ids,
+            "failed_ids": failed_ids,
+            "completed_at": datetime.now().isoformat()
+        }
             
     except Exception as e:
         logger.error(f"Batch calculation failed: {e}")
@@ -134,6 +162,9 @@ def calculate_question_difficulties_batch(self, question_ids: List[str], days_ba
             "failed_at": datetime.now().isoformat()
         }
 
+# Rows deactivated per transaction by cleanup_old_metrics
+CLEANUP_CHUNK_SIZE = 5000
+
 @celery_app.task(bind=True)
 def cleanup_old_metrics(self, days_to_keep: int = 90):
     """
@@ -144,18 +175,30 @@ def cleanup_old_metrics(self, days_to_keep: int = 90):
         
         cutoff_date = datetime.now() - timedelta(days=days_to_keep)
         
-        db = next(get_db())
+        db = next(get_sync_db())
         try:
-            # Soft delete old metrics
-            result = db.execute(text("""
+            # Soft delete old metrics in committed chunks: short lock windows
+            # and bounded WAL per transaction instead of one huge UPDATE
+            lock_clause = "FOR UPDATE SKIP LOCKED" if db.bind.dialect.name == "postgresql" else ""
+            deactivate_chunk = text(f"""
                 UPDATE question_metrics 
                 SET is_active = FALSE, updated_at = NOW()
-                WHERE last_computed < :cutoff_date AND is_active = TRUE
-            """), {"cutoff_date": cutoff_date})
+                WHERE id IN (
+                    SELECT id FROM question_metrics
+                    WHERE last_computed < :cutoff_date AND is_active = TRUE
+                    LIMIT :chunk_size
+                    {lock_clause}
+                )
+            """)
             
-            db.commit()
+            deactivated_count = 0
+            while True:
+                result = db.execute(deactivate_chunk, {"cutoff_date": cutoff_date, "chunk_size": CLEANUP_CHUNK_SIZE})
+                db.commit()
+                if result.rowcount == 0:
+                    break
+                deactivated_count += result.rowcount
             
-            deactivated_count = result.rowcount
             logger.info(f"Cleanup completed: {deactivated_count} metrics deactivated")
             
             return {
@@ -184,36 +227,43 @@ def generate_difficulty_report(self, days_back: int = 7):
     try:
         logger.info(f"Generating difficulty report for last {days_back} days")
         
-        db = next(get_db())
+        db = next(get_sync_db())
         try:
             cutoff_date = datetime.now() - timedelta(days=days_back)
             
-            # Get metrics summary
-            summary_query = text("""
-                SELECT 
-                    COUNT(*) as total_questions,
-                    AVG(global_success_rate) as avg_success_rate,
-                    AVG(difficulty_score) as avg_difficulty_score,
-                    COUNT(CASE WHEN computed_difficulty = 'beginner' THEN 1 END) as beginner_count,
-                    COUNT(CASE WHEN computed_difficulty = 'intermediate' THEN 1 END) as intermediate_count,
-                    COUNT(CASE WHEN computed_difficulty = 'advanced' THEN 1 END) as advanced_count
-                FROM question_metrics 
-                WHERE is_active = TRUE 
-                AND last_computed >= :cutoff_date
-            """)
-            
-            summary = db.execute(summary_query, {"cutoff_date": cutoff_date}).fetchone()
-            
-            # Get top difficult questions
-            difficult_query = text("""
-                SELECT question_id, difficulty_score, computed_difficulty, global_success_rate
-                FROM question_metrics 
-                WHERE is_active = TRUE AND last_computed >= :cutoff_date
-                ORDER BY difficulty_score DESC 
-                LIMIT 10
+            # Summary and top difficult questions in one round trip: the CTE is
+            # referenced twice, so it is materialized and the slice scanned once.
+            # The summary always yields one row; question columns are NULL
+            # when there is nothing to report.
+            report_query = text("""
+                WITH active AS (
+                    SELECT question_id, difficulty_score, computed_difficulty, global_success_rate
+                    FROM question_metrics 
+                    WHERE is_active = TRUE AND last_computed >= :cutoff_date
+                ),
+                summary AS (
+                    SELECT 
+                        COUNT(*) as total_questions,
+                        AVG(global_success_rate) as avg_success_rate,
+                        AVG(difficulty_score) as avg_difficulty_score,
+                        COUNT(CASE WHEN computed_difficulty = 'beginner' THEN 1 END) as beginner_count,
+                        COUNT(CASE WHEN computed_difficulty = 'intermediate' THEN 1 END) as intermediate_count,
+                        COUNT(CASE WHEN computed_difficulty = 'advanced' THEN 1 END) as advanced_count
+                    FROM active
+                )
+                SELECT s.*, d.question_id, d.difficulty_score, d.computed_difficulty, d.global_success_rate
+                FROM summary s
+                LEFT JOIN (
+                    SELECT * FROM active
+                    ORDER BY difficulty_score DESC 
+                    LIMIT 10
+                ) d ON 1 = 1
+                ORDER BY d.difficulty_score DESC
             """)
             
-            difficult_questions = db.execute(difficult_query, {"cutoff_date": cutoff_date}).fetchall()
+            rows = db.execute(report_query, {"cutoff_date": cutoff_date}).fetchall()
+            summary = rows[0]
+            difficult_questions = [row for row in rows if row.question_id is not None]
             
             report = {
                 "report_period_days": days_back,
@@ -257,6 +307,33 @@ def generate_difficulty_report(self, days_back: int = 7):
             "failed_at": datetime.now().isoformat()
         }
 
+@celery_app.task(bind=True)
+def refresh_difficulty_view(self):
+    """
+    Refresh the pre-aggregated 30-day difficulty view without blocking readers
+    """
+    try:
+        db = next(get_sync_db())
+        try:
+            db.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {DIFFICULTY_VIEW}"))
+            db.commit()
+            
+            return {
+                "success": True,
+                "completed_at": datetime.now().isoformat()
+            }
+            
+        finally:
+            db.close()
+            
+    except Exception as e:
+        logger.error(f"Difficulty view refresh failed: {e}")
+        return {
+            "success": False,
+            "error": str(e),
+            "failed_at": datetime.now().isoformat()
+        }
+
 # Periodic task scheduling
 celery_app.conf.beat_schedule = {
     'daily-difficulty-calculation': {
@@ -264,6 +341,10 @@ celery_app.conf.beat_schedule = {
         'schedule': 86400.0,  # 24 hours in seconds
         'args': (30, False),  # days_back=30, force_recalculate=False
     },
+    'difficulty-view-refresh': {
+        'task': 'app.tasks.difficulty_tasks.refresh_difficulty_view',
+        'schedule': float(DIFFICULTY_VIEW_REFRESH_SECONDS),  # 10 minutes
+    },
     'weekly-cleanup': {
         'task': 'app.tasks.difficulty_tasks.cleanup_old_metrics',
         'schedule': 604800.0,  # 7 days in seconds
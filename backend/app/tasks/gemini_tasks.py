@@ -0,0 +1,95 @@
+"""
+Celery tasks for background Gemini question analysis (routed to gemini_queue)
+"""
+
+import logging
+from datetime import datetime
+from typing import List
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from ..db import AsyncSessionLocal
+from ..models import Question, GeminiAnalysisRecord
+from ..services.gemini_service import analyze_questions_batch, load_course_taxonomy
+from .client import ANALYZE_QUESTIONS_TASK
+from .difficulty_tasks import celery_app, _run_async
+
+logger = logging.getLogger(__name__)
+
+async def _analyze_and_store(task_id: str, course_id: int, question_ids: List[int]) -> dict:
+    """Analyze the given questions in batched prompts and upsert one gemini_analysis row per (task, question)"""
+    async with AsyncSessionLocal() as db:
+        taxonomy = await load_course_taxonomy(db, course_id)
+        if taxonomy is None:
+            return {"success": False, "error": "Course not found"}
+        course, topics, subtopics, knowledge_types = taxonomy
+
+        result = await db.execute(
+            select(Question.id, Question.text).where(Question.id.in_(question_ids))
+        )
+        questions = result.all()
+        if not questions:
+            return {"success": True, "processed_count": 0, "failed_count": 0, "missing_ids": question_ids}
+
+        results = await analyze_questions_batch(
+            question_texts=[q.text for q in questions],
+            course_name=course.display_name,
+            existing_topics=topics,
+            existing_subtopics=subtopics,
+            existing_knowledge_types=knowledge_types
+        )
+
+        records = [
+            {"question_id": q.id, "task_id": task_id, "success": bool(r.get("success")), "result": r}
+            for q, r in zip(questions, results)
+        ]
+        insert = pg_insert if db.bind.dialect.name == "postgresql" else sqlite_insert
+        stmt = insert(GeminiAnalysisRecord).values(records)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["task_id", "question_id"],
+            set_={
+                "success": stmt.excluded.success,
+                "result": stmt.excluded.result,
+                "updated_at": func.now(),
+            },
+        )
+        await db.execute(stmt)
+        await db.commit()
+
+    found = {q.id for q in questions}
+    failed_count = sum(1 for record in records if not record["success"])
+    return {
+        "success": True,
+        "processed_count": len(records),
+        "failed_count": failed_count,
+        "missing_ids": [q_id for q_id in question_ids if q_id not in found],
+    }
+
+@celery_app.task(bind=True, max_retries=3, name=ANALYZE_QUESTIONS_TASK)
+def analyze_questions_task(self, course_id: int, question_ids: List[int]):
+    """
+    Analyze stored questions with Gemini off the request path
+    """
+    try:
+        logger.info(f"Analyzing {len(question_ids)} questions for course {course_id}")
+
+        summary = _run_async(_analyze_and_store(self.request.id, course_id, question_ids))
+
+        logger.info(f"Gemini analysis completed: {summary.get('processed_count', 0)} questions stored")
+
+        return {**summary, "completed_at": datetime.now().isoformat()}
+
+    except Exception as e:
+        logger.error(f"Gemini analysis failed: {e}")
+
+        # Retry with exponential backoff (API outage, DB hiccup)
+        if self.request.retries < self.max_retries:
+            raise self.retry(countdown=30 * (2 ** self.request.retries))
+
+        return {
+            "success": False,
+            "error": str(e),
+            "question_ids": question_ids,
+            "failed_at": datetime.now().isoformat()
+        }
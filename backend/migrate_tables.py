@@ -6,6 +6,7 @@ Database migration script for MAB Quiz System
 
 import asyncio
 import os
+import re
 import sys
 import io
 
@@ -18,43 +19,67 @@ from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy import text
 from app.models import Base
 from app.models.knowledge_type import DEFAULT_KNOWLEDGE_TYPES
+from app.services.difficulty_calculator import DIFFICULTY_VIEW, DIFFICULTY_VIEW_STATEMENTS
+
+# Questions of a removed knowledge type are reassigned to this one
+FALLBACK_KNOWLEDGE_TYPE = DEFAULT_KNOWLEDGE_TYPES[0]["name"]  # recall
 
 
 async def check_table_exists(conn, table_name: str) -> bool:
     """Check if a table exists in the database"""
-    result = await conn.execute(text(f"""
-        SELECT EXISTS (
-            SELECT FROM information_schema.tables
-            WHERE table_name = '{table_name}'
-        );
-    """))
+    # Bound parameter: no SQL built from the name, and the prepared plan is reused
+    result = await conn.execute(text("SELECT to_regclass(:table_name) IS NOT NULL"), {"table_name": table_name})
     return result.scalar()
 
 
+async def get_public_tables(conn) -> set:
+    """Names of the tables in the public schema"""
+    # pg_catalog directly; information_schema.tables is a view that also
+    # evaluates per-row privilege checks
+    result = await conn.execute(text("""
+        SELECT tablename FROM pg_catalog.pg_tables WHERE schemaname = 'public'
+    """))
+    return {row[0] for row in result.fetchall()}
+
+
 async def migrate_knowledge_types_table(conn):
-    """Drop and recreate knowledge_types table with Bloom taxonomy types"""
+    """Create knowledge_types with the Bloom taxonomy types, or sync an existing table in place"""
     print("\n📋 Migrating 'knowledge_types' table...")
 
     exists = await check_table_exists(conn, 'knowledge_types')
 
     if exists:
-        # Check if any questions reference knowledge_types
-        try:
+        # No DROP ... CASCADE: question links survive unless their type is removed.
+        # Insert missing types and refresh changed ones first (matching rows are
+        # not rewritten), so the fallback type exists before anything is removed
+        await conn.execute(text("""
+            INSERT INTO knowledge_types (name, display_name, description)
+            VALUES (:name, :display_name, :description)
+            ON CONFLICT (name) DO UPDATE
+            SET display_name = EXCLUDED.display_name, description = EXCLUDED.description, is_active = TRUE
+            WHERE (knowledge_types.display_name, knowledge_types.description, knowledge_types.is_active)
+                IS DISTINCT FROM (EXCLUDED.display_name, EXCLUDED.description, TRUE)
+        """), DEFAULT_KNOWLEDGE_TYPES)
+
+        target_names = [kt["name"] for kt in DEFAULT_KNOWLEDGE_TYPES]
+        result = await conn.execute(text("SELECT name FROM knowledge_types"))
+        stale_names = [row[0] for row in result.fetchall() if row[0] not in target_names]
+
+        if stale_names:
+            # questions.knowledge_type_id is NOT NULL with ON DELETE RESTRICT:
+            # move questions off the removed types instead of unlinking them
             result = await conn.execute(text("""
-                SELECT COUNT(*) FROM questions WHERE knowledge_type_id IS NOT NULL
-            """))
-            question_count = result.scalar() or 0
-
-            if question_count > 0:
-                print(f"  ⚠️  {question_count} questions reference knowledge_types")
-                await conn.execute(text("UPDATE questions SET knowledge_type_id = NULL"))
-                print("  ✅ Set all question knowledge_type_id to NULL")
-        except Exception as e:
-            print(f"  ⚠️  Could not check questions: {e}")
-
-        # Drop the table
-        await conn.execute(text("DROP TABLE IF EXISTS knowledge_types CASCADE"))
-        print("  ✅ Dropped old knowledge_types table")
+                UPDATE questions
+                SET knowledge_type_id = (SELECT id FROM knowledge_types WHERE name = :fallback)
+                WHERE knowledge_type_id IN (SELECT id FROM knowledge_types WHERE name = ANY(:names))
+            """), {"fallback": FALLBACK_KNOWLEDGE_TYPE, "names": stale_names})
+            if result.rowcount:
+                print(f"  ⚠️  Moved {result.rowcount} questions from removed knowledge types to '{FALLBACK_KNOWLEDGE_TYPE}'")
+            await conn.execute(text("DELETE FROM knowledge_types WHERE name = ANY(:names)"), {"names": stale_names})
+            print(f"  ✅ Removed {len(stale_names)} old knowledge types: {', '.join(stale_names)}")
+
+        print(f"  ✅ {len(DEFAULT_KNOWLEDGE_TYPES)} Bloom taxonomy knowledge types verified")
+        return
 
     # Create new table
     await conn.execute(text("""
@@ -70,12 +95,11 @@ async def migrate_knowledge_types_table(conn):
     """))
     print("  ✅ Created new knowledge_types table")
 
-    # Insert default Bloom taxonomy types
-    for kt in DEFAULT_KNOWLEDGE_TYPES:
-        await conn.execute(text("""
-            INSERT INTO knowledge_types (name, display_name, description)
-            VALUES (:name, :display_name, :description)
-        """), kt)
+    # Insert default Bloom taxonomy types (one executemany, not a round trip per row)
+    await conn.execute(text("""
+        INSERT INTO knowledge_types (name, display_name, description)
+        VALUES (:name, :display_name, :description)
+    """), DEFAULT_KNOWLEDGE_TYPES)
 
     print(f"  ✅ Inserted {len(DEFAULT_KNOWLEDGE_TYPES)} Bloom taxonomy knowledge types")
 
@@ -84,9 +108,73 @@ async def migrate_knowledge_types_table(conn):
     print("  ✅ Created index on knowledge_types")
 
 
-async def migrate_database():
-    """Run database migration"""
-
+CONCURRENT_INDEXES = [
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_questions_active_created "
+    "ON questions (is_active, created_at DESC) WHERE is_active",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_questions_subtopic_active_created "
+    "ON questions (subtopic_id, is_active, created_at DESC)",
+    # Matches COUNT(DISTINCT DATE(created_at)) in /api/difficulty/stats/global
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_student_responses_created_date "
+    "ON student_responses (DATE(created_at))",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_student_responses_created_question "
+    "ON student_responses (created_at, question_id)",
+    # Delta fetch in /api/v1/sync/mab (user_id = ? AND updated_at > ?)
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_question_updated "
+    "ON user_mab_question_arms (user_id, updated_at)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_topic_updated "
+    "ON user_mab_topic_arms (user_id, updated_at)",
+    # Chunked UPDATE in cleanup_old_metrics (last_computed < ? AND is_active)
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_qm_active_lastcomp "
+    "ON question_metrics (last_computed) WHERE is_active = TRUE",
+    # Summary + top-10 in generate_difficulty_report
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_qm_active_lastcomp_difficulty "
+    "ON question_metrics (is_active, last_computed, difficulty_score DESC)",
+]
+
+
+# Session settings for the migration transaction and the index builds
+MIGRATION_SETTINGS = [
+    "maintenance_work_mem = '512MB'",
+    "work_mem = '64MB'",
+    "synchronous_commit = off",
+]
+INDEX_BUILD_SETTING = "maintenance_work_mem = '512MB'"
+
+# Table a CONCURRENT_INDEXES statement builds on
+_RE_INDEX_TABLE = re.compile(r"\bON (\w+)")
+
+
+async def create_table_indexes(engine, statements):
+    """Run one table's index builds in order on their own connection"""
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        # Session-level: SET LOCAL has no effect outside a transaction block
+        await conn.execute(text(f"SET {INDEX_BUILD_SETTING}"))
+        for statement in statements:
+            await conn.execute(text(statement))
+        await conn.execute(text("RESET maintenance_work_mem"))
+
+
+async def create_concurrent_indexes(engine):
+    """Create hot-path indexes without blocking writes"""
+    print("\n📇 Creating indexes...")
+
+    # Concurrent builds on the same table wait for each other, so each table
+    # gets one connection and the tables are indexed in parallel
+    statements_by_table = {}
+    for statement in CONCURRENT_INDEXES:
+        table = _RE_INDEX_TABLE.search(statement).group(1)
+        statements_by_table.setdefault(table, []).append(statement)
+    await asyncio.gather(*(
+        create_table_indexes(engine, statements) for statements in statements_by_table.values()
+    ))
+
+    print(f"  ✅ {len(CONCURRENT_INDEXES)} indexes verified")
+
+
+def get_database_url() -> str:
+    """DATABASE_URL rewritten for the asyncpg driver"""
     database_url = os.getenv("DATABASE_URL")
     if not database_url:
         print("❌ ERROR: DATABASE_URL environment variable not set")
@@ -97,32 +185,51 @@ async def migrate_database():
         database_url = database_url.replace("postgres://", "postgresql+asyncpg://", 1)
     elif not database_url.startswith("postgresql+asyncpg://"):
         database_url = database_url.replace("postgresql://", "postgresql+asyncpg://")
+    return database_url
+
+
+async def migrate_database(engine=None):
+    """
+    Run database migration. Pass an engine to reuse its pooled connections;
+    otherwise one is created for this run and disposed at the end.
+    """
+    owns_engine = engine is None
+    if owns_engine:
+        engine = create_async_engine(get_database_url(), echo=False)
 
     print("=" * 60)
     print("🚀 MAB Quiz Database Migration")
     print("=" * 60)
 
     try:
-        engine = create_async_engine(database_url, echo=False)
-
         async with engine.begin() as conn:
+            # One-shot bulk DDL/DML: bigger sort memory, no WAL flush wait per
+            # statement. SET LOCAL reverts when the transaction commits.
+            for setting in MIGRATION_SETTINGS:
+                await conn.execute(text(f"SET LOCAL {setting}"))
+
             # Migrate knowledge_types table
             await migrate_knowledge_types_table(conn)
 
-            # Create any missing tables
+            # Create any missing tables; one catalog query instead of
+            # create_all's per-table existence checks
             print("\n🏗️  Creating/verifying tables...")
-            await conn.run_sync(Base.metadata.create_all)
+            existing_tables = await get_public_tables(conn)
+            missing = [t for t in Base.metadata.sorted_tables if t.name not in existing_tables]
+            if missing:
+                await conn.run_sync(Base.metadata.create_all, tables=missing, checkfirst=False)
+                print(f"  ✅ Created {len(missing)} tables: {', '.join(t.name for t in missing)}")
             print("  ✅ All tables verified")
 
-            # Show final table list
-            result = await conn.execute(text("""
-                SELECT table_name FROM information_schema.tables
-                WHERE table_schema = 'public' ORDER BY table_name
-            """))
-            tables = [row[0] for row in result.fetchall()]
+            # Difficulty aggregate view
+            for statement in DIFFICULTY_VIEW_STATEMENTS:
+                await conn.execute(text(statement))
+            print(f"  ✅ {DIFFICULTY_VIEW} verified")
+
+            tables = existing_tables | {t.name for t in missing}
             print(f"\n✅ Migration completed! ({len(tables)} tables)")
 
-        await engine.dispose()
+        await create_concurrent_indexes(engine)
 
     except Exception as e:
         print(f"\n❌ Migration failed: {str(e)}")
@@ -130,6 +237,10 @@ async def migrate_database():
         print(traceback.format_exc())
         sys.exit(1)
 
+    finally:
+        if owns_engine:
+            await engine.dispose()
+
 
 if __name__ == "__main__":
     asyncio.run(migrate_database())
\ No newline at end of file
@@ -2,56 +2,66 @@
 Sample data seeder for development
 """
 import asyncio
-import json
+import os
+from sqlalchemy import insert, select
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
-from app.models import Base, Question
+from app.models import Base, Course, Topic, Subtopic, KnowledgeType, Question, DEFAULT_KNOWLEDGE_TYPES
 from app.db import DATABASE_URL
 
-# Örnek sorular
+# Örnek sorular (subject -> ders adı; zorluk öğrenci yanıtlarından hesaplanır, saklanmaz)
 SAMPLE_QUESTIONS = [
     {
         "question_id": "farm_001",
-        "subject": "farmakoloji", 
-        "difficulty": "easy",
+        "subject": "farmakoloji",
         "type": "multiple_choice",
         "text": "Aspirin hangi grupta yer alır?",
-        "options": {
-            "A": "Antibiyotik",
-            "B": "Analjezik",
-            "C": "Antiviral", 
-            "D": "Antihistaminik",
-            "correct": "B"
-        }
+        "options": ["Antibiyotik", "Analjezik", "Antiviral", "Antihistaminik"],
+        "correct_answer": "Analjezik"
     },
     {
         "question_id": "term_001",
         "subject": "terminoloji",
-        "difficulty": "easy", 
         "type": "true_false",
         "text": "Cardio- ön eki kalp anlamına gelir.",
-        "options": {
-            "correct": True
-        }
+        "options": None,
+        "correct_answer": "true"
     },
     {
         "question_id": "farm_002",
         "subject": "farmakoloji",
-        "difficulty": "medium",
-        "type": "multiple_choice", 
+        "type": "multiple_choice",
         "text": "Parasetamolün maksimum günlük dozu nedir?",
-        "options": {
-            "A": "2 gram",
-            "B": "3 gram", 
-            "C": "4 gram",
-            "D": "5 gram",
-            "correct": "C"
-        }
+        "options": ["2 gram", "3 gram", "4 gram", "5 gram"],
+        "correct_answer": "4 gram"
     }
 ]
 
+# Örnek sorular "recall" (Hatırlama) tipinde
+SAMPLE_KNOWLEDGE_TYPE = DEFAULT_KNOWLEDGE_TYPES[0]
+
+
+async def _get_or_create(session: AsyncSession, model, defaults: dict, **filters):
+    """Mevcut satırı döndür, yoksa oluştur (seeder tekrar çalıştırılabilir)"""
+    result = await session.execute(select(model).filter_by(**filters))
+    obj = result.scalar_one_or_none()
+    if obj is None:
+        obj = model(**filters, **defaults)
+        session.add(obj)
+        await session.flush()
+    return obj
+
+
+async def _sample_subtopic_id(session: AsyncSession, subject: str) -> int:
+    """Ders -> "Genel" konu -> "Genel" alt konu zincirini hazırla"""
+    course = await _get_or_create(session, Course, {"display_name": subject.capitalize()}, name=subject)
+    topic = await _get_or_create(session, Topic, {"display_name": "Genel"}, course_id=course.id, name="genel")
+    subtopic = await _get_or_create(session, Subtopic, {"display_name": "Genel"}, topic_id=topic.id, name="genel")
+    return subtopic.id
+
+
 async def seed_data():
     """Örnek verileri veritabanına ekle"""
-    engine = create_async_engine(DATABASE_URL, echo=True)
+    engine = create_async_engine(DATABASE_URL, echo=os.getenv("SQL_ECHO") == "1")
     
     # Tabloları oluştur
     async with engine.begin() as conn:
@@ -60,16 +70,29 @@ async def seed_data():
     # Verileri ekle
     SessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
     async with SessionLocal() as session:
-        for q_data in SAMPLE_QUESTIONS:
-            question = Question(
-                question_id=q_data["question_id"],
-                subject=q_data["subject"],
-                difficulty=q_data["difficulty"], 
-                type=q_data["type"],
-                text=q_data["text"],
-                options_json=json.dumps(q_data["options"], ensure_ascii=False)
-            )
-            session.add(question)
+        knowledge_type = await _get_or_create(
+            session, KnowledgeType,
+            {k: v for k, v in SAMPLE_KNOWLEDGE_TYPE.items() if k != "name"},
+            name=SAMPLE_KNOWLEDGE_TYPE["name"]
+        )
+        subtopic_ids = {
+            subject: await _sample_subtopic_id(session, subject)
+            for subject in dict.fromkeys(q["subject"] for q in SAMPLE_QUESTIONS)
+        }
+
+        # Tek bir executemany INSERT (ORM nesnesi / satır başına flush yok)
+        await session.execute(insert(Question), [
+            {
+                "question_id": q_data["question_id"],
+                "subtopic_id": subtopic_ids[q_data["subject"]],
+                "knowledge_type_id": knowledge_type.id,
+                "type": q_data["type"],
+                "text": q_data["text"],
+                "options": q_data["options"],  # JSON sütunu: sürücü tek seferde serileştirir
+                "correct_answer": q_data["correct_answer"],
+            }
+            for q_data in SAMPLE_QUESTIONS
+        ])
         
         await session.commit()
         print(f"✅ {len(SAMPLE_QUESTIONS)} örnek soru eklendi!")
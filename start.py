@@ -1,17 +1,24 @@
 #!/usr/bin/env python3
 import os
 import sys
-import subprocess
+import uvicorn
 
 # Railway deployment script
 if __name__ == "__main__":
     # Change to backend directory
-    backend_dir = os.path.join(os.path.dirname(__file__), 'backend')
+    backend_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend')
     os.chdir(backend_dir)
-    
+
     # Get port from environment
     port = os.environ.get("PORT", "8000")
-    
-    # Start uvicorn
-    cmd = ["uvicorn", "app.main:app", "--host", "0.0.0.0", "--port", str(port)]
-    subprocess.run(cmd)
\ No newline at end of file
+
+    # Start uvicorn in this process (no child interpreter; signals reach the server directly)
+    uvicorn.run(
+        "app.main:app",
+        app_dir=backend_dir,
+        host="0.0.0.0",
+        port=int(port),
+        workers=int(os.environ.get("WEB_CONCURRENCY", "1")),
+        loop="uvloop",
+        http="httptools",
+    )